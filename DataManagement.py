@@ -1,7 +1,12 @@
 import os
-import json
+import time
 from flask import jsonify
 from config import logger , Config
+from domain_store import (fetch_domains, query_domains, fetch_versions, insert_domains, delete_domain,
+                          get_connection, transaction, write_domains)
+from history_store import record_checks, prune_history
+from json_files import json_files
+from bulk_domains import clean_hosts
 
 
 
@@ -14,46 +19,30 @@ def json_directory():
 
 def load_domains(username):
     try:
-        json_dir = json_directory()
-        file_path = os.path.join(json_dir, f'{username}_domains.json')
-        if not os.path.exists(file_path):
-            with open(file_path, 'w') as f:
-                json.dump({"domains":[]}, f)
-
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-        return data.get("domains")
+        return fetch_domains(username)
     except Exception as e:
         return jsonify({'message': 'An error occurred while checking domains.', 'error': str(e)}), 500
     
 
+def load_domain_page(username, filters=None, sort=None, cursor=None, limit=None):
+    """{'domains': [...], 'next_cursor': ...} for one filtered/sorted page of the user's list"""
+    domains, next_cursor = query_domains(username, filters, sort, cursor, limit or Config.DOMAIN_PAGE_SIZE)
+    return {'domains': domains, 'next_cursor': next_cursor}
+
+def domains_version(username):
+    """Moves on every write to the user's domains, including check results"""
+    return fetch_versions(username)[0]
+
 def add_domains(domains, username):
     try:
-        current_domains=load_domains(username)
-        current_domains.append(domains)
-        return True
+        # Same host cleanup as the bulk import, hosts already stored are skipped
+        return insert_domains(username, clean_hosts(domains))
     except Exception as e:
         return jsonify({'message': 'An error occurred while adding domains.', 'error': str(e)})
     
 def remove_domain(domain_to_remove, username):
     try:
-        json_dir = json_directory()
-        file_path = os.path.join(json_dir, f'{username}_domains.json')
-        domains = load_domains(username)
-        domain_found=False
-        
-        for i in range(len(domains)):
-            if domains[i]['url'] == domain_to_remove:
-                del domains[i]
-                domain_found=True
-                break
-
-        if domain_found:
-            with open(file_path, 'w') as f:
-                json.dump({"domains": domains}, f, indent=4)
-            return True
-        else:     
-            return False
+        return delete_domain(username, domain_to_remove)
     except Exception as e:
         return jsonify({'message': 'An error occurred while removing the domain.', 'error': str(e)})
 
@@ -61,27 +50,13 @@ def remove_domain(domain_to_remove, username):
 
 def update_domains(domains, username):
     try:
-        json_dir = json_directory()
-        file_path = os.path.join(json_dir, f'{username}_domains.json')
-        # Load current domains
-        current_domains = load_domains(username)
-        
-        # Update or add new domains
-        for domain in domains:
-            # Check if domain already exists
-            existing_domain = next((d for d in current_domains if d['url'] == domain['url']), None)
-            
-            if existing_domain:
-                # Update existing domain
-                existing_domain.update(domain)
-            else:
-                # Add new domain
-                current_domains.append(domain)
-        
-        # Write updated domains back to file
-        with open(file_path, 'w') as f:
-            json.dump({"domains": current_domains}, f, indent=4)
-        
+        checked_at = time.time()
+        conn = get_connection()
+        # History and results in one transaction, existing rows keep their position
+        with transaction(conn):
+            record_checks(conn, username, domains, checked_at)
+            write_domains(conn, username, domains, checked_at=checked_at)
+        prune_history()
         return True
     except Exception as e:
         logger.error(f"Error updating domains: {e}")
@@ -91,46 +66,32 @@ def update_domains(domains, username):
     
 # schedular data management
 
+def tasks_file_path(username):
+    return os.path.join(json_directory(), f"{username}_tasks.json")
+
+def tasks_version(username):
+    """Moves on every change of the user's tasks file, from any process, response caches compare against it"""
+    return json_files.version(tasks_file_path(username))
+
 def load_user_tasks(username):
     """Charge les tâches planifiées d'un utilisateur depuis un fichier JSON."""
-    json_dir = json_directory()
-    filepath = os.path.join(json_dir, f"{username}_tasks.json")
-    if os.path.exists(filepath):
-        with open(filepath, "r") as file:
-            return json.load(file)
-    return {"tasks": []}
+    return json_files.read(tasks_file_path(username), default=lambda: {"tasks": []})
 
 def save_user_tasks(username, tasks):
     """Sauvegarde les tâches planifiées d'un utilisateur dans un fichier JSON."""
-    json_dir = json_directory()
-    filepath = os.path.join(json_dir, f"{username}_tasks.json")
-    with open(filepath, "w") as file:
-        json.dump({"tasks": tasks}, file, indent=4)
+    json_files.write(tasks_file_path(username), {"tasks": tasks})
 
 def update_user_task(username, new_task):
     """Update a user's task with improved state management"""
-    try:
-        json_dir = json_directory()
-        file_path = os.path.join(json_dir, f"{username}_tasks.json")
-        
-        # Load existing tasks or create new structure
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as f:
-                tasks_data = json.load(f)
-        else:
-            tasks_data = {"tasks": []}
-
-        # Remove any existing task with the same job_id
-        tasks_data["tasks"] = [task for task in tasks_data["tasks"] 
+    def replace_task(tasks_data):
+        # Remove any existing task with the same job_id, then add the new one
+        tasks_data["tasks"] = [task for task in tasks_data["tasks"]
                              if task.get("job_id") != new_task["job_id"]]
-        
-        # Add the new task
         tasks_data["tasks"].append(new_task)
-        
-        # Save updated tasks
-        with open(file_path, 'w') as f:
-            json.dump(tasks_data, f, indent=4)
-            
+
+    try:
+        # Read, replace and write under the file lock so concurrent updates cannot drop each other's task
+        json_files.update(tasks_file_path(username), replace_task, default=lambda: {"tasks": []})
         logger.info(f"Successfully updated task for {username}: {new_task}")
         return True
     except Exception as e:
@@ -0,0 +1,186 @@
+import asyncio
+import ipaddress
+import socket
+import threading
+from collections import Counter, deque
+from config import logger , Config
+from dns_cache import dns_cache
+
+
+def destination_key(address, host):
+    """Group probes by network (/24 for IPv4, /48 for IPv6) so one hosting provider is not hammered"""
+    if address is None:
+        return host
+    ip = ipaddress.ip_address(address)
+    prefix = 24 if ip.version == 4 else 48
+    return str(ipaddress.ip_network(f'{address}/{prefix}', strict=False))
+
+
+def resolve_destination(host):
+    try:
+        return destination_key(dns_cache.resolve(host)[0], host)
+    except (socket.gaierror, ValueError):
+        return host
+
+
+async def resolve_destination_async(host):
+    try:
+        return destination_key((await dns_cache.resolve_async(host))[0], host)
+    except (socket.gaierror, ValueError):
+        return host
+
+
+class AdaptiveLimiter():
+    """AIMD concurrency limit for the checker, with a fixed cap per destination network
+
+    Every ADAPTIVE_WINDOW finished probes the limit grows by ADAPTIVE_STEP while latency and
+    error rate stay under their targets, and is multiplied by ADAPTIVE_BACKOFF when the share
+    of timeouts goes over ADAPTIVE_TIMEOUT_THRESHOLD. Threads and event loops share the same
+    slots, so in_flight and the destination caps hold for the whole process.
+    """
+
+    def __init__(self, min_limit, max_limit, initial_limit, destination_cap, enabled=True):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(initial_limit if enabled else max_limit)
+        self.destination_cap = destination_cap
+        self.enabled = enabled
+        self.in_flight = 0
+        self._per_destination = Counter()
+        self._cond = threading.Condition()
+        self._async_waiters = deque()  # (future, loop, destination, limit) in arrival order
+        self._window = Counter()  # samples, errors, timeouts
+        self._window_latency = 0.0
+        self.last_window = {}
+
+    @property
+    def target(self):
+        return max(self.min_limit, min(self.max_limit, int(self.limit)))
+
+    def _admit(self, destination, limit=None):
+        """Take a global and a destination slot when both are free, called with the lock held"""
+        target = self.target if limit is None else min(self.target, limit)
+        if self.in_flight < target and self._per_destination[destination] < self.destination_cap:
+            self.in_flight += 1
+            self._per_destination[destination] += 1
+            return True
+        return False
+
+    def acquire(self, destination, timeout=None):
+        """Block until both the global and the destination slot are free, False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._admit(destination), timeout=timeout)
+
+    async def acquire_async(self, destination, limit=None):
+        """acquire for an event loop, waits without blocking it, limit lowers the global slots for this caller"""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self._admit(destination, limit):
+                return
+            waiter = (loop.create_future(), loop, destination, limit)
+            self._async_waiters.append(waiter)
+        try:
+            await waiter[0]
+        except asyncio.CancelledError:
+            with self._cond:
+                if waiter in self._async_waiters:
+                    self._async_waiters.remove(waiter)
+                else:
+                    # The slot was granted while the waiter was being cancelled
+                    self._free(destination)
+            raise
+
+    def release(self, destination, latency, outcome):
+        with self._cond:
+            self.record(latency, outcome)
+            self._free(destination)
+
+    def _free(self, destination):
+        self.in_flight -= 1
+        self._per_destination[destination] -= 1
+        if self._per_destination[destination] <= 0:
+            del self._per_destination[destination]
+        self._wake_async()
+        self._cond.notify_all()
+
+    def _wake_async(self):
+        """Hand free slots to waiting coroutines in arrival order, skipping those whose destination is full"""
+        waiting = deque()
+        while self._async_waiters and self.in_flight < self.target:
+            waiter = self._async_waiters.popleft()
+            future, loop, destination, limit = waiter
+            if self._admit(destination, limit):
+                loop.call_soon_threadsafe(grant, future)
+            else:
+                waiting.append(waiter)
+        waiting.extend(self._async_waiters)
+        self._async_waiters = waiting
+
+    def record(self, latency, outcome):
+        """Feed one finished probe into the current window, outcome is 'ok', 'error' or 'timeout'"""
+        with self._cond:
+            self._window['samples'] += 1
+            self._window[outcome] += 1
+            self._window_latency += latency
+            if self._window['samples'] >= Config.ADAPTIVE_WINDOW:
+                self._adjust()
+
+    def _adjust(self):
+        samples = self._window['samples']
+        latency = self._window_latency / samples
+        error_rate = self._window['error'] / samples
+        timeout_rate = self._window['timeout'] / samples
+        previous = self.target
+
+        if self.enabled:
+            if timeout_rate > Config.ADAPTIVE_TIMEOUT_THRESHOLD:
+                self.limit = max(self.min_limit, self.limit * Config.ADAPTIVE_BACKOFF)
+            elif latency <= Config.ADAPTIVE_LATENCY_TARGET and error_rate <= Config.ADAPTIVE_ERROR_THRESHOLD:
+                self.limit = min(self.max_limit, self.limit + Config.ADAPTIVE_STEP)
+
+        self.last_window = {
+            'samples': samples,
+            'avg_latency': round(latency, 4),
+            'error_rate': round(error_rate, 4),
+            'timeout_rate': round(timeout_rate, 4)
+        }
+        self._window.clear()
+        self._window_latency = 0.0
+        if self.target != previous:
+            logger.info(f"Checker concurrency {previous} -> {self.target} "
+                        f"(latency {latency:.2f}s, errors {error_rate:.0%}, timeouts {timeout_rate:.0%})")
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                'current_concurrency': self.in_flight,
+                'target_concurrency': self.target,
+                'min_concurrency': self.min_limit,
+                'max_concurrency': self.max_limit,
+                'destination_cap': self.destination_cap,
+                'active_destinations': len(self._per_destination),
+                'adaptive': self.enabled,
+                'last_window': self.last_window
+            }
+
+
+def grant(future):
+    # Runs on the waiter's loop, the future may have been cancelled since the slot was taken
+    if not future.done():
+        future.set_result(True)
+
+
+def probe_outcome(status_code, latency):
+    """Probes that ran into the HTTP timeout count as timeouts even when they surfaced as FAILED"""
+    if status_code == 'TIMEOUT' or latency >= Config.HTTP_TIMEOUT:
+        return 'timeout'
+    return 'ok' if status_code == 'OK' else 'error'
+
+
+limiter = AdaptiveLimiter(
+    min_limit=Config.ADAPTIVE_MIN_CONCURRENCY,
+    max_limit=Config.MAX_WORKERS,
+    initial_limit=min(Config.ADAPTIVE_INITIAL_CONCURRENCY, Config.MAX_WORKERS),
+    destination_cap=Config.DESTINATION_MAX_CONCURRENCY,
+    enabled=Config.ADAPTIVE_CONCURRENCY
+)
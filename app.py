@@ -1,19 +1,25 @@
-from flask import Flask, request, jsonify, redirect 
+from flask import Flask, request, jsonify, redirect, Response
 from flask_cors import CORS
 from login import check_login, check_username_avaliability, registration
-from domains_check_MT import check_url_mt as check_url
-from DataManagement import (load_domains, remove_domain, update_user_task, delete_user_task, load_user_tasks)
+from DataManagement import (load_domains, update_domains, remove_domain, update_user_task, delete_user_task, load_user_tasks,
+                            load_domain_page, domains_version, tasks_version)
 import os
-from datetime import datetime, timedelta
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
-from apscheduler.triggers.cron import CronTrigger
+from datetime import datetime, timedelta, timezone
 from config import Config, logger
+from check_engine import check_url, iter_check_url
+from scheduling import scheduled_checks, start_scheduler, schedule_hourly_check, schedule_daily_check, remove_user_jobs
 import requests
 from oauthlib.oauth2 import WebApplicationClient
 import json
 import time
 from utils import Utils
+from check_jobs import CheckJobManager, JobQueueFull
+from adaptive_limiter import limiter
+from domain_view import domain_view
+from history_store import uptime, cert_events
+from bulk_domains import import_domains, export_domains, clean_hosts
+from metrics import registry, Gauge
+from response_cache import conditional_json_response
 from elasticapm.contrib.flask import ElasticAPM
 from elasticapm import set_custom_context, capture_span, traces
 import elasticapm
@@ -45,9 +51,13 @@ CORS(app, resources={
 
 os.environ['OAUTHLIB_INSECURE_TRANSPORT']='1'
 
-# Initialize scheduler for background tasks
-scheduler = BackgroundScheduler()
-scheduler.start()
+# Background check jobs for the submit/poll API
+check_jobs = CheckJobManager(
+    iter_check=iter_check_url,
+    max_workers=Config.CHECK_JOB_WORKERS,
+    max_queued=Config.CHECK_JOB_MAX_QUEUED,
+    retention=Config.CHECK_JOB_RETENTION
+)
 
 # Google OAuth client setup
 client = WebApplicationClient(Config.GOOGLE_CLIENT_ID)
@@ -169,6 +179,8 @@ def google_callback():
         return jsonify({"error": str(e)}), 500
 
 # Domain management routes
+PROBE_MODES = ('get', 'stream', 'head')
+
 @app.route("/api/domains/check", methods=['POST'])
 @utils.measure_this
 def check_domains():
@@ -177,15 +189,20 @@ def check_domains():
     """Check status of provided domains"""
     try:
         data = request.json
-        domains = data.get('domains', [])
+        # Stored under the same host as imported and added domains, so they dedupe against each other
+        domains = clean_hosts(data.get('domains', []))
         username = data.get('username')
         logger.info(f"User {username} started checking {len(domains)} domains.")
         
 
+        probe_mode = data.get('probe_mode')
+
         if not domains or not username:
             return jsonify({"error": "Missing required data"}), 400
+        if probe_mode and probe_mode not in PROBE_MODES:
+            return jsonify({"error": f"probe_mode must be one of {', '.join(PROBE_MODES)}"}), 400
         
-        results = check_url(domains, username , apm_context)
+        results = check_url(domains, username , apm_context, probe_mode=probe_mode)
 
         #logger.info(f"Results: {results}")
         apm_client.end_transaction('domain_check' , 'success')
@@ -195,17 +212,188 @@ def check_domains():
         apm_client.end_transaction('domain_check' , 'failed')
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/domains/check/stream", methods=['POST'])
+def check_domains_stream():
+    """Check domains and stream each result as soon as it is ready (NDJSON or SSE)"""
+    data = request.json or {}
+    domains = clean_hosts(data.get('domains', []))
+    username = data.get('username')
+    stream_format = (request.args.get('format') or data.get('format') or 'ndjson').lower()
+    probe_mode = data.get('probe_mode')
+
+    if not domains or not username:
+        return jsonify({"error": "Missing required data"}), 400
+    if probe_mode and probe_mode not in PROBE_MODES:
+        return jsonify({"error": f"probe_mode must be one of {', '.join(PROBE_MODES)}"}), 400
+    if stream_format not in ('ndjson', 'sse'):
+        return jsonify({"error": "format must be 'ndjson' or 'sse'"}), 400
+
+    apm_client.begin_transaction('domain_check_stream')
+    apm_context = traces.execution_context.get_transaction()
+    logger.info(f"User {username} started streaming check of {len(domains)} domains.")
+
+    def encode(record, event):
+        if stream_format == 'sse':
+            return f"event: {event}\ndata: {json.dumps(record)}\n\n"
+        return json.dumps(record) + "\n"
+
+    def generate():
+        started = time.monotonic()
+        results = []
+        outcome = 'failed'
+        try:
+            for result in iter_check_url(domains, username, apm_context, probe_mode=probe_mode):
+                results.append(result)
+                yield encode(result, 'result')
+
+            ok = sum(1 for result in results if result['status_code'] == 'OK')
+            yield encode({"summary": {
+                "total": len(domains),
+                "received": len(results),
+                "ok": ok,
+                "failed": len(results) - ok,
+                "elapsed": round(time.monotonic() - started, 3)
+            }}, 'summary')
+            outcome = 'success'
+        except Exception as e:
+            logger.error(f"Streaming domain check error: {str(e)}")
+            yield encode({"error": str(e)}, 'error')
+        finally:
+            # Persist whatever finished, even if the client went away mid-stream
+            update_domains(results, username)
+            apm_client.end_transaction('domain_check_stream', outcome)
+
+    mimetype = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+    return Response(generate(), mimetype=mimetype, headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route("/api/domains/jobs", methods=['POST'])
+def submit_check_job():
+    """Queue a domain check and return its job id immediately"""
+    try:
+        data = request.json or {}
+        domains = clean_hosts(data.get('domains', []))
+        username = data.get('username')
+        probe_mode = data.get('probe_mode')
+
+        if not domains or not username:
+            return jsonify({"error": "Missing required data"}), 400
+        if probe_mode and probe_mode not in PROBE_MODES:
+            return jsonify({"error": f"probe_mode must be one of {', '.join(PROBE_MODES)}"}), 400
+
+        job = check_jobs.submit(username, domains, probe_mode=probe_mode)
+        return jsonify(job.snapshot()), 202
+    except JobQueueFull as e:
+        logger.warning(f"Rejected check job: {str(e)}")
+        return jsonify({"error": str(e)}), 429
+    except Exception as e:
+        logger.error(f"Error submitting check job: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/domains/jobs", methods=['GET'])
+def list_check_jobs():
+    """List a user's check jobs with their progress counts"""
+    username = request.args.get('username')
+    if not username:
+        return jsonify({"error": "Username required"}), 400
+    return jsonify([job.snapshot() for job in check_jobs.list(username)])
+
+@app.route("/api/domains/jobs/<job_id>", methods=['GET'])
+def get_check_job(job_id):
+    """Progress and partial or final results of a check job, pass offset to fetch only new results"""
+    try:
+        username = request.args.get('username')
+        offset = int(request.args.get('offset', 0))
+        if not username:
+            return jsonify({"error": "Username required"}), 400
+
+        job = check_jobs.get(job_id)
+        if job is None or job.username != username:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(job.snapshot(offset=max(offset, 0)))
+    except ValueError:
+        return jsonify({"error": "offset must be an integer"}), 400
+    except Exception as e:
+        logger.error(f"Error reading check job {job_id}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+# In-process metrics, scraped by Prometheus independently of the APM server
+for name, description, callback in (
+    ('domain_checker_concurrency_current', 'Probes holding an adaptive limiter slot', lambda: limiter.in_flight),
+    ('domain_checker_concurrency_target', 'Concurrency the adaptive limiter currently allows', lambda: limiter.target),
+    ('domain_check_jobs_pending', 'Queued or running background check jobs', lambda: check_jobs.pending()),
+    ('scheduled_checks_running', 'Scheduled checks probing right now', lambda: scheduled_checks.running),
+    ('scheduled_checks_waiting', 'Scheduled checks queued behind the concurrency cap', lambda: scheduled_checks.waiting),
+):
+    registry.register(Gauge(name, description, callback=callback))
+
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    """Prometheus text format: per-phase probe latency, result counters, queue depths and limiter gauges"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route("/api/checker/concurrency", methods=['GET'])
+def checker_concurrency():
+    """Current and target concurrency of the adaptive checker limiter"""
+    return jsonify(limiter.snapshot())
+
+DOMAIN_LIST_PARAMS = ('status_code', 'ssl_status', 'issuer', 'expires_before', 'sort', 'cursor', 'limit')
+DOMAIN_SORTS = ('expiration_date', '-expiration_date')
+
+def domain_list_query():
+    """(filters, sort, cursor, limit) from the query args, None when none of them was given
+
+    status_code, ssl_status and issuer take comma separated values, expires_before a UTC
+    "%Y-%m-%d" or "%Y-%m-%dT%H:%M:%S". Raises ValueError on anything malformed.
+    """
+    if not any(request.args.get(name) for name in DOMAIN_LIST_PARAMS):
+        return None
+    filters = {}
+    for name in ('status_code', 'ssl_status', 'issuer'):
+        values = [value.strip() for value in request.args.get(name, '').split(',') if value.strip()]
+        if values:
+            filters[name] = tuple(values)
+    expires_before = request.args.get('expires_before')
+    if expires_before:
+        date_format = "%Y-%m-%dT%H:%M:%S" if 'T' in expires_before else "%Y-%m-%d"
+        filters['expires_before'] = datetime.strptime(expires_before, date_format).strftime("%Y-%m-%d %H:%M:%S")
+    sort = request.args.get('sort') or None
+    if sort and sort not in DOMAIN_SORTS:
+        raise ValueError(f"sort must be one of {', '.join(DOMAIN_SORTS)}")
+    limit = int(request.args.get('limit') or Config.DOMAIN_PAGE_SIZE)
+    if not 1 <= limit <= Config.DOMAIN_PAGE_MAX:
+        raise ValueError(f"limit must be between 1 and {Config.DOMAIN_PAGE_MAX}")
+    return filters, sort, request.args.get('cursor') or None, limit
+
 @app.route("/api/domains/list", methods=['GET'])
 @utils.measure_this
 def get_domains():
-    """Get list of domains for a user"""
+    """Get list of domains for a user, polls with a matching If-None-Match get a 304
+
+    Without query args the whole list is returned. Any of status_code, ssl_status, issuer,
+    expires_before, sort, cursor or limit switches to pages of {"domains", "next_cursor"}, filtered
+    pages without a sort come by expiration_date.
+    """
     try:
         username = request.args.get('username')
         if not username:
             return jsonify({"error": "Username required"}), 400
-            
-        domains = load_domains(username)
-        return jsonify(domains)
+
+        query = domain_list_query()
+        if query is None:
+            return conditional_json_response(
+                ('domains', username), domains_version(username), lambda: load_domains(username)
+            )
+        filters, sort, cursor, limit = query
+        return conditional_json_response(
+            ('domains', username, tuple(sorted(filters.items())), sort, cursor, limit),
+            domains_version(username),
+            lambda: load_domain_page(username, filters, sort, cursor, limit)
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error loading domains: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -229,14 +417,95 @@ def remove_domain_endpoint():
         logger.error(f"Error removing domain: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
-# Scheduler routes
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
 
-scheduler = BackgroundScheduler({
-    'apscheduler.timezone': 'UTC',
-    'apscheduler.job_defaults.coalesce': True,  # Combine missed executions
-    'apscheduler.job_defaults.max_instances': 1  # Prevent multiple instances
-})
-scheduler.start()
+def transfer_format(content_type='', file_name=''):
+    """csv or ndjson, from the format query arg or else the upload's content type / file name"""
+    fmt = request.args.get('format')
+    if fmt:
+        return fmt.lower()
+    if 'ndjson' in content_type or 'json' in content_type or file_name.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return 'csv'
+
+@app.route("/api/domains/import", methods=['POST'])
+def import_domains_endpoint():
+    """Bulk add domains from a CSV or NDJSON upload (multipart 'file' or raw body), parsed as a stream"""
+    try:
+        username = request.args.get('username')
+        if not username:
+            return jsonify({"error": "Username required"}), 400
+
+        upload = request.files.get('file')
+        if upload is not None:
+            stream, fmt = upload.stream, transfer_format(upload.mimetype or '', upload.filename or '')
+        else:
+            stream, fmt = request.stream, transfer_format(request.mimetype or '')
+        if fmt not in EXPORT_MIMETYPES:
+            return jsonify({"error": "format must be csv or ndjson"}), 400
+
+        stats = import_domains(stream, username, fmt)
+        return jsonify({"status": "success", **stats})
+    except Exception as e:
+        logger.error(f"Error importing domains: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/domains/export", methods=['GET'])
+def export_domains_endpoint():
+    """Stream a user's domains and their last results as CSV or NDJSON"""
+    username = request.args.get('username')
+    if not username:
+        return jsonify({"error": "Username required"}), 400
+    fmt = transfer_format()
+    if fmt not in EXPORT_MIMETYPES:
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    return Response(
+        export_domains(username, fmt),
+        mimetype=EXPORT_MIMETYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename={username}_domains.{fmt}"}
+    )
+
+def history_range():
+    """start/end query args as epoch seconds, UTC "%Y-%m-%dT%H:%M:%S", defaulting to the last 7 days"""
+    def parse(value, default):
+        if not value:
+            return default
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+    end = parse(request.args.get('end'), time.time())
+    start = parse(request.args.get('start'), end - 7 * 86400)
+    return start, end
+
+@app.route("/api/domains/uptime", methods=['GET'])
+def domains_uptime():
+    """Uptime percentage per domain over a time range, pass url for a single domain"""
+    try:
+        username = request.args.get('username')
+        if not username:
+            return jsonify({"error": "Username required"}), 400
+        start, end = history_range()
+        return jsonify(uptime(username, start, end, url=request.args.get('url')))
+    except ValueError:
+        return jsonify({"error": "start and end must look like 2024-01-31T00:00:00"}), 400
+    except Exception as e:
+        logger.error(f"Error reading uptime: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/domains/cert-events", methods=['GET'])
+def domains_cert_events():
+    """Certificate changes (issued, renewed, issuer_changed, invalid, restored) over a time range"""
+    try:
+        username = request.args.get('username')
+        if not username:
+            return jsonify({"error": "Username required"}), 400
+        start, end = history_range()
+        return jsonify(cert_events(username, start, end, url=request.args.get('url')))
+    except ValueError:
+        return jsonify({"error": "start and end must look like 2024-01-31T00:00:00"}), 400
+    except Exception as e:
+        logger.error(f"Error reading certificate events: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+# Scheduler routes
 
 @app.route("/api/schedule/hourly", methods=["POST"])
 def schedule_hourly():
@@ -246,53 +515,11 @@ def schedule_hourly():
         username = data.get('username')
         interval = data.get('interval', 1)
         
-        # Get the domains for this user
-        domains = [domain["url"] for domain in load_domains(username)]
-        
-        if not domains:
+        # The job loads the user's domains each time it runs, here we only refuse an empty list
+        if not domain_view.urls(username):
             return jsonify({"status": "error", "message": "No domains found"}), 400
 
-        def scheduled_task():
-            """Wrapper function to handle the scheduled check and update next run time"""
-            try:
-                logger.info(f"Starting scheduled check for user {username}")
-                # Perform the domain check
-                check_url(domains, username)
-                
-                # Get the current job and its next run time
-                job = scheduler.get_job(f"{username}_hourly_task")
-                if job and job.next_run_time:
-                    # Update the task information in our database
-                    new_task = {
-                        "type": "hourly",
-                        "interval": interval,
-                        "next_run": job.next_run_time.strftime("%Y-%m-%dT%H:%M:%S"),
-                        "job_id": f"{username}_hourly_task",
-                        "last_run": datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-                    }
-                    update_user_task(username, new_task)
-                    logger.info(f"Updated next run time for {username} to {job.next_run_time}")
-            except Exception as e:
-                logger.error(f"Error in scheduled task for {username}: {str(e)}")
-
-        # Remove any existing job for this user
-        job_id = f"{username}_hourly_task"
-        if scheduler.get_job(job_id):
-            scheduler.remove_job(job_id)
-
-        # Add the new job with the wrapper function
-        job = scheduler.add_job(
-            func=scheduled_task,
-            trigger=IntervalTrigger(
-                hours=interval,
-                start_date=datetime.now() + timedelta(seconds=5)  # Start in 5 seconds
-            ),
-            id=job_id,
-            name=f"Hourly domain check for {username}",
-            replace_existing=True,
-            coalesce=True,
-            max_instances=1
-        )
+        job = schedule_hourly_check(username, interval)
 
         # Record the initial task information
         next_run = job.next_run_time
@@ -300,7 +527,7 @@ def schedule_hourly():
             "type": "hourly",
             "interval": interval,
             "next_run": next_run.strftime("%Y-%m-%dT%H:%M:%S"),
-            "job_id": job_id,
+            "job_id": job.id,
             "created_at": datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
         }
         update_user_task(username, new_task)
@@ -322,65 +549,12 @@ def schedule_daily():
         data = request.json
         username = data.get('username')
         time = data.get('time', '00:00')
-        hour, minute = map(int, time.split(':'))
         
-        # Get the domains for this user
-        domains = [domain["url"] for domain in load_domains(username)]
-        
-        if not domains:
+        # The job loads the user's domains each time it runs, here we only refuse an empty list
+        if not domain_view.urls(username):
             return jsonify({"status": "error", "message": "No domains found"}), 400
 
-        def scheduled_daily_task():
-            """Wrapper function to handle the daily check and update next run time"""
-            try:
-                logger.info(f"Starting scheduled daily check for user {username}")
-                
-                # Perform the domain check
-                check_url(domains, username)
-                
-                # Get the current job and its next run time
-                job = scheduler.get_job(f"{username}_daily_task")
-                if job and job.next_run_time:
-                    # Update the task information in our database
-                    new_task = {
-                        "type": "daily",
-                        "time": time,
-                        "next_run": job.next_run_time.strftime("%Y-%m-%dT%H:%M:%S"),
-                        "job_id": f"{username}_daily_task",
-                        "last_run": datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-                    }
-                    update_user_task(username, new_task)
-                    logger.info(f"Updated next run time for {username}'s daily task to {job.next_run_time}")
-            except Exception as e:
-                logger.error(f"Error in daily scheduled task for {username}: {str(e)}")
-
-        # Remove any existing job for this user
-        job_id = f"{username}_daily_task"
-        if scheduler.get_job(job_id):
-            scheduler.remove_job(job_id)
-
-        # Calculate the first run time
-        now = datetime.now()
-        run_time = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-        
-        # If the specified time has already passed today, start tomorrow
-        if run_time <= now:
-            run_time = run_time + timedelta(days=1)
-
-        # Add the new job with the wrapper function
-        job = scheduler.add_job(
-            func=scheduled_daily_task,
-            trigger=CronTrigger(
-                hour=hour,
-                minute=minute,
-                start_date=run_time  # Ensure first run is at the correct time
-            ),
-            id=job_id,
-            name=f"Daily domain check for {username} at {time}",
-            replace_existing=True,
-            coalesce=True,
-            max_instances=1
-        )
+        job = schedule_daily_check(username, time)
 
         # Record the initial task information
         next_run = job.next_run_time
@@ -388,7 +562,7 @@ def schedule_daily():
             "type": "daily",
             "time": time,
             "next_run": next_run.strftime("%Y-%m-%dT%H:%M:%S"),
-            "job_id": job_id,
+            "job_id": job.id,
             "created_at": datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
         }
         update_user_task(username, new_task)
@@ -411,6 +585,7 @@ def stop_schedule():
         if not username:
             return jsonify({"status": "error", "message": "Username required"}), 400
             
+        remove_user_jobs(username)
         delete_user_task(username)
         return jsonify({"status": "success"})
     except Exception as e:
@@ -419,25 +594,34 @@ def stop_schedule():
 
 @app.route("/api/schedule/status", methods=["GET"])
 def schedule_status():
-    """Get status of scheduled tasks for a user"""
+    """Get status of scheduled tasks for a user, polls with a matching If-None-Match get a 304"""
     try:
         username = request.args.get('username')
         if not username:
             return jsonify({"status": "error", "message": "Username required"}), 400
-            
-        tasks = load_user_tasks(username).get("tasks", [])
-        return jsonify({
-            "status": "success" if tasks else "no task",
-            "tasks": tasks
-        })
+
+        def status():
+            tasks = load_user_tasks(username).get("tasks", [])
+            return {
+                "status": "success" if tasks else "no task",
+                "tasks": tasks
+            }
+
+        return conditional_json_response(('tasks', username), tasks_version(username), status)
     except Exception as e:
         logger.error(f"Error checking schedule status: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 if __name__ == '__main__':
+    debug = Config.FLASK_DEBUG == 'true'
+    # Scheduled jobs persist in the domains database and must run in one process only. Not on
+    # import, where spawned check workers (__mp_main__) would start their own, and not in the
+    # reloader parent, which only watches files while WERKZEUG_RUN_MAIN marks the serving child.
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_scheduler()
     logger.info(f"Starting backend service on {Config.FLASK_HOST}:{Config.FLASK_PORT}")
     app.run(
-        debug=Config.FLASK_DEBUG,
+        debug=debug,
         host=Config.FLASK_HOST,
         port=Config.FLASK_PORT
     )
\ No newline at end of file
@@ -0,0 +1,165 @@
+"""Offline throughput benchmark for the domain checker
+
+Starts the local farm (see farm.py) in a child process, maps thousands of synthetic
+*.bench.test hosts onto it and runs one full check through the chosen engine, without
+touching the internet or the domain store. Prints or writes a JSON report:
+
+    python benchmarks/check_throughput.py --domains 5000 --engine threads --output run.json
+    python benchmarks/check_throughput.py --mix ok=0.7,slow=0.1,hang=0.1,reset=0.1 --env MAX_WORKERS=200
+
+--env KEY=VALUE overrides any Config setting for the run.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import farm
+from common import prepare_environment, percentiles, peak_rss_mb, ThreadSampler, write_report
+
+DEFAULT_MIX = 'ok=0.85,slow=0.05,hang=0.02,reset=0.03,slowbody=0.03,redirect=0.02'
+# What a correct checker reports for each behaviour, anything else counts as a mismatch.
+# A hang ends as FAILED when HTTP_TIMEOUT fires first and as TIMEOUT when DOMAIN_CHECK_TIMEOUT does.
+EXPECTED_STATUS = {
+    'ok': ('OK',), 'slow': ('OK',), 'slowbody': ('OK',), 'redirect': ('OK',),
+    'hang': ('FAILED', 'TIMEOUT'), 'reset': ('FAILED',)
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        behaviour, _, share = part.partition('=')
+        behaviour = behaviour.strip()
+        if behaviour not in farm.BEHAVIOURS:
+            raise argparse.ArgumentTypeError(f"Unknown behaviour '{behaviour}', expected one of {', '.join(farm.BEHAVIOURS)}")
+        mix[behaviour] = float(share)
+    return mix
+
+
+def synthetic_hosts(count, mix, seed):
+    """count host names with behaviours drawn from mix, shuffled so slow hosts are not bunched"""
+    total = sum(mix.values())
+    hosts = []
+    for behaviour, share in mix.items():
+        hosts.extend(farm.host_name(behaviour, number) for number in range(int(round(count * share / total))))
+    hosts = hosts[:count]
+    while len(hosts) < count:
+        hosts.append(farm.host_name('ok', len(hosts) + count))
+    random.Random(seed).shuffle(hosts)
+    return hosts
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--domains', type=int, default=2000)
+    parser.add_argument('--engine', choices=('threads', 'async'), default='threads')
+    parser.add_argument('--probe-mode', choices=('get', 'stream', 'head'), default=None)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f'default {DEFAULT_MIX}')
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds a 'slow' host waits before answering")
+    parser.add_argument('--slow-body', type=float, default=1.0, help="seconds a 'slowbody' host takes to send its body")
+    parser.add_argument('--http-port', type=int, default=18080)
+    parser.add_argument('--https-port', type=int, default=18443)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='check-bench-')
+    cert_path, key_path = farm.ensure_certificate(workdir)
+    prepare_environment(workdir, [
+        f'PROBE_HTTP_PORT={args.http_port}',
+        f'PROBE_HTTPS_PORT={args.https_port}',
+        # Every bench host shares 127.0.0.1, the per-/24 cap would otherwise be the whole limit
+        f'DESTINATION_MAX_CONCURRENCY={os.getenv("DESTINATION_MAX_CONCURRENCY", 100000)}',
+        # Trust the farm certificate in both ssl.create_default_context() and requests
+        f'SSL_CERT_FILE={cert_path}',
+        f'REQUESTS_CA_BUNDLE={cert_path}',
+        *args.env
+    ])
+
+    # The farm starts before any repo module so the child inherits no checker threads
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    server = context.Process(
+        target=farm.run_farm,
+        args=(args.http_port, args.https_port, args.latency, args.slow_body, cert_path, key_path, ready),
+        daemon=True
+    )
+    server.start()
+    if not ready.wait(timeout=30):
+        server.terminate()
+        raise SystemExit('The bench farm did not start within 30 seconds')
+
+    try:
+        farm.install_resolver()
+        from config import Config
+        from metrics import PHASE_SECONDS, CHECK_LOST
+        if args.engine == 'async':
+            from domains_check_async import iter_check_url_async as iter_check_url
+        else:
+            from domains_check_MT import iter_check_url_mt as iter_check_url
+
+        # Keep every raw phase sample, the exported histogram buckets are too coarse for p99
+        samples = {}
+        observe = PHASE_SECONDS.observe
+
+        def record(value, **labels):
+            samples.setdefault(labels.get('phase'), []).append(value)
+            observe(value, **labels)
+
+        PHASE_SECONDS.observe = record
+
+        hosts = synthetic_hosts(args.domains, args.mix, args.seed)
+        by_behaviour = {}
+        seen = set()
+        started = time.monotonic()
+        with ThreadSampler() as threads:
+            for result in iter_check_url(hosts, 'bench', probe_mode=args.probe_mode):
+                seen.add(result['url'])
+                by_behaviour.setdefault(farm.behaviour_of(result['url']), Counter())[result['status_code']] += 1
+        elapsed = time.monotonic() - started
+    finally:
+        server.terminate()
+        server.join()
+
+    mismatched = sum(
+        count for behaviour, statuses in by_behaviour.items()
+        for status, count in statuses.items() if status not in EXPECTED_STATUS[behaviour]
+    )
+    report = {
+        'benchmark': 'check_throughput',
+        'engine': args.engine,
+        'probe_mode': args.probe_mode or Config.PROBE_MODE,
+        'domains': args.domains,
+        'mix': args.mix,
+        'latency_seconds': args.latency,
+        'slow_body_seconds': args.slow_body,
+        'config': {key: getattr(Config, key) for key in (
+            'MAX_WORKERS', 'ASYNC_CONCURRENCY', 'ADAPTIVE_CONCURRENCY', 'HTTP_TIMEOUT', 'SSL_TIMEOUT',
+            'DOMAIN_CHECK_TIMEOUT', 'OVERALL_CHECK_TIMEOUT', 'HTTP_REUSE_TLS_CONNECTION'
+        )},
+        'elapsed_seconds': round(elapsed, 3),
+        'domains_per_second': round(args.domains / elapsed, 1) if elapsed else None,
+        'latency': percentiles(samples.get('total', [])),
+        'phases': {phase: dict(percentiles(values), count=len(values)) for phase, values in sorted(samples.items())},
+        'statuses': {behaviour: dict(statuses) for behaviour, statuses in sorted(by_behaviour.items())},
+        'mismatched': mismatched,
+        'lost': CHECK_LOST.value(),
+        'missing': args.domains - len(seen),
+        'peak_threads': threads.peak,
+        'peak_rss_mb': peak_rss_mb()
+    }
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
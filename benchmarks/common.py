@@ -0,0 +1,77 @@
+import json
+import math
+import os
+import resource
+import sys
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def prepare_environment(workdir, overrides=()):
+    """Point storage and logs at workdir and apply KEY=VALUE overrides, must run before any repo import
+
+    config.py only reads .env for keys that are not already set, so these win over it.
+    """
+    os.environ.setdefault('JSON_DIRECTORY', os.path.join(workdir, 'Jsons'))
+    os.environ.setdefault('LOGS_DIRECTORY', os.path.join(workdir, 'logs'))
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    for override in overrides:
+        key, _, value = override.partition('=')
+        os.environ[key.strip()] = value.strip()
+    os.makedirs(os.environ['JSON_DIRECTORY'], exist_ok=True)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    """Nearest-rank percentiles in seconds, None when there are no samples"""
+    ordered = sorted(samples)
+    result = {}
+    for point in points:
+        if not ordered:
+            result[f'p{point}'] = None
+            continue
+        rank = max(math.ceil(point / 100.0 * len(ordered)), 1)
+        result[f'p{point}'] = round(ordered[rank - 1], 6)
+    return result
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, ru_maxrss is in KiB on Linux"""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+class ThreadSampler():
+    """Samples threading.active_count() in the background and keeps the peak"""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='thread-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, threading.active_count())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def write_report(report, path=None):
+    """JSON to path, or to stdout when no path is given"""
+    report.setdefault('finished_at', time.strftime('%Y-%m-%dT%H:%M:%S%z'))
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if path:
+        with open(path, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
@@ -0,0 +1,164 @@
+"""Local stand-ins for the sites the checker probes
+
+One plain HTTP and one TLS listener serve every synthetic host. The host name picks the
+behaviour, '<behaviour>-<n>.bench.test':
+
+    ok        200 with a small body
+    slow      200 after --latency seconds
+    hang      reads the request and never answers
+    reset     reads the request and resets the connection (TLS: fails the handshake)
+    slowbody  200 whose body trickles in over --slow-body seconds
+    redirect  301 to the same host on the TLS listener, which answers 200
+
+The certificate is self-signed for *.bench.test, created with the openssl command line tool.
+"""
+import asyncio
+import os
+import socket
+import ssl
+import struct
+import subprocess
+
+BENCH_SUFFIX = '.bench.test'
+BEHAVIOURS = ('ok', 'slow', 'hang', 'reset', 'slowbody', 'redirect')
+BODY = b'<html><body>bench</body></html>\n'
+SLOW_BODY_CHUNKS = 10
+
+
+def host_name(behaviour, number):
+    return f'{behaviour}-{number}{BENCH_SUFFIX}'
+
+
+def behaviour_of(host):
+    name = (host or '').split(':')[0].lower()
+    behaviour = name.split('-', 1)[0]
+    return behaviour if name.endswith(BENCH_SUFFIX) and behaviour in BEHAVIOURS else 'ok'
+
+
+def ensure_certificate(directory):
+    """Create a self-signed wildcard certificate for the bench hosts, returns (cert_path, key_path)"""
+    cert_path = os.path.join(directory, 'bench-cert.pem')
+    key_path = os.path.join(directory, 'bench-key.pem')
+    if not os.path.exists(cert_path):
+        subprocess.run([
+            'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '2',
+            '-keyout', key_path, '-out', cert_path,
+            '-subj', f'/CN=*{BENCH_SUFFIX}', '-addext', f'subjectAltName=DNS:*{BENCH_SUFFIX}'
+        ], check=True, capture_output=True)
+    return cert_path, key_path
+
+
+def install_resolver(address='127.0.0.1'):
+    """Make every *.bench.test name resolve to address in this process, other names resolve as usual"""
+    real_getaddrinfo = socket.getaddrinfo
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if isinstance(host, str) and host.rstrip('.').endswith(BENCH_SUFFIX):
+            host = address
+        return real_getaddrinfo(host, port, *args, **kwargs)
+
+    socket.getaddrinfo = getaddrinfo
+
+
+def reset(writer):
+    """Close with SO_LINGER 0 so the peer sees a RST instead of a FIN"""
+    sock = writer.get_extra_info('socket')
+    if sock is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    writer.transport.abort()
+
+
+async def read_request_head(reader):
+    """Return (method, host) of the request, None when the client went away first"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method = request_line.split(b' ', 1)[0].decode('latin-1')
+    host = ''
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'host':
+            host = value.strip()
+    return method, host
+
+
+def response_head(status, reason, headers=()):
+    lines = [f'HTTP/1.1 {status} {reason}', 'Connection: close', *headers]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+class Farm():
+    def __init__(self, http_port, https_port, latency, slow_body, cert_path, key_path):
+        self.http_port = http_port
+        self.https_port = https_port
+        self.latency = latency
+        self.slow_body = slow_body
+        self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.ssl_context.load_cert_chain(cert_path, key_path)
+        self.ssl_context.sni_callback = self._sni
+
+    def _sni(self, ssl_socket, server_name, context):
+        if behaviour_of(server_name) == 'reset':
+            return ssl.ALERT_DESCRIPTION_HANDSHAKE_FAILURE
+        return None
+
+    async def handle(self, reader, writer, is_tls=False):
+        try:
+            head = await read_request_head(reader)
+            if head is None:
+                return
+            method, host = head
+            behaviour = 'ok' if is_tls and behaviour_of(host) == 'redirect' else behaviour_of(host)
+            if behaviour == 'hang':
+                await reader.read()  # until the checker gives up and closes
+                return
+            if behaviour == 'reset':
+                reset(writer)
+                return
+            if behaviour == 'redirect':
+                location = f"https://{host.split(':')[0]}:{self.https_port}/"
+                writer.write(response_head(301, 'Moved Permanently', [f'Location: {location}', 'Content-Length: 0']))
+                await writer.drain()
+                return
+            if behaviour == 'slow':
+                await asyncio.sleep(self.latency)
+
+            if behaviour == 'slowbody':
+                chunk = BODY * 4
+                writer.write(response_head(200, 'OK', [f'Content-Length: {len(chunk) * SLOW_BODY_CHUNKS}']))
+                for _ in range(SLOW_BODY_CHUNKS):
+                    if method == 'HEAD':
+                        break
+                    await writer.drain()
+                    await asyncio.sleep(self.slow_body / SLOW_BODY_CHUNKS)
+                    writer.write(chunk)
+            else:
+                writer.write(response_head(200, 'OK', [f'Content-Length: {len(BODY)}']))
+                if method != 'HEAD':
+                    writer.write(BODY)
+            await writer.drain()
+        except (ConnectionError, ssl.SSLError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if not writer.transport.is_closing():
+                writer.close()
+
+    async def serve(self, ready=None):
+        http_server = await asyncio.start_server(self.handle, '127.0.0.1', self.http_port, backlog=4096)
+        https_server = await asyncio.start_server(
+            lambda reader, writer: self.handle(reader, writer, is_tls=True),
+            '127.0.0.1', self.https_port, ssl=self.ssl_context, backlog=4096
+        )
+        if ready is not None:
+            ready.set()
+        async with http_server, https_server:
+            await asyncio.gather(http_server.serve_forever(), https_server.serve_forever())
+
+
+def run_farm(http_port, https_port, latency, slow_body, cert_path, key_path, ready=None):
+    """Process entry point, serves until the process is terminated"""
+    farm = Farm(http_port, https_port, latency, slow_body, cert_path, key_path)
+    asyncio.run(farm.serve(ready))
@@ -0,0 +1,187 @@
+"""Storage, login and API microbenchmarks at growing data sizes
+
+For each scale a child process gets a fresh data directory holding a users.json with that
+many users, one user with that many domains (plus check history) and a tasks file with that
+many tasks. It then times the DataManagement and login functions, and the Flask endpoints
+through the test client:
+
+    python benchmarks/storage_ops.py --scales 1000,10000,100000 --output storage.json
+    python benchmarks/storage_ops.py --scales 10000 --only login --env JSON_FLUSH_DELAY=0
+
+Every operation is repeated for at least --min-time seconds to get ops/s, then run once more
+under tracemalloc for its peak traced memory and the memory blocks it left allocated.
+"""
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import prepare_environment, peak_rss_mb, write_report
+
+BENCH_USER = 'benchuser'
+GROUPS = ('data', 'login', 'api')
+
+
+def synthetic_results(count, prefix='site'):
+    """Check results shaped like the checker's, a tenth of them failed"""
+    return [{
+        'url': f'{prefix}-{number}.example.com',
+        'status_code': 'FAILED' if number % 10 == 0 else 'OK',
+        'ssl_status': 'unknown' if number % 10 == 0 else 'valid',
+        'expiration_date': 'unknown' if number % 10 == 0 else '2030-01-01 00:00:00',
+        'issuer': 'unknown' if number % 10 == 0 else 'Bench CA'
+    } for number in range(count)]
+
+
+def generate_data(scale):
+    """Write the synthetic users.json, domain rows and tasks file for one scale"""
+    from DataManagement import json_directory, tasks_file_path
+    from domain_store import upsert_domains
+    from json_files import write_json_atomic
+    from scheduling import TASK_TIME_FORMAT
+
+    users = [{'username': BENCH_USER, 'password': 'secret', 'full_name': None,
+              'is_google_user': False, 'profile_picture': None}]
+    users.extend({'username': f'user{number}', 'password': f'password{number}', 'full_name': f'User {number}',
+                  'is_google_user': number % 5 == 0, 'profile_picture': None} for number in range(scale - 1))
+    write_json_atomic(os.path.join(json_directory(), 'users.json'), {'users': users})
+
+    upsert_domains(BENCH_USER, synthetic_results(scale), checked_at=time.time() - 3600)
+
+    next_run = time.strftime(TASK_TIME_FORMAT, time.localtime(time.time() + 3600))
+    tasks = [{'type': 'hourly', 'interval': 1, 'next_run': next_run, 'job_id': f'{BENCH_USER}_hourly_{number}'}
+             for number in range(scale)]
+    write_json_atomic(tasks_file_path(BENCH_USER), {'tasks': tasks})
+
+
+def operations(scale):
+    """(group, name, callable) for every timed operation, callables vary their input per call"""
+    import DataManagement
+    import login
+    from app import app
+
+    client = app.test_client()
+    counter = iter(range(10 ** 9))
+    results = synthetic_results(scale)
+    removable = [result['url'] for result in results[::-1]]
+    next_run = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    def update_task():
+        number = next(counter) % scale
+        DataManagement.update_user_task(BENCH_USER, {
+            'type': 'hourly', 'interval': 2, 'next_run': next_run, 'job_id': f'{BENCH_USER}_hourly_{number}'
+        })
+
+    def existing_user():
+        number = next(counter) % (scale - 1)
+        return f'user{number}', f'password{number}'
+
+    def expect_ok(response):
+        if response.status_code != 200:
+            raise RuntimeError(f'{response.request.path} answered {response.status_code}')
+        # Drain the whole body without buffering it, a streamed response would otherwise stop at its first chunk
+        for _ in response.response:
+            pass
+        response.close()
+
+    # Read-only operations first, the mutating ones then only shift the data by a few hundred rows
+    return [
+        ('data', 'load_domains', lambda: DataManagement.load_domains(BENCH_USER)),
+        ('data', 'load_user_tasks', lambda: DataManagement.load_user_tasks(BENCH_USER)),
+        ('login', 'check_login', lambda: login.check_login(*existing_user())),
+        ('login', 'check_username_avaliability', lambda: login.check_username_avaliability(f'free{next(counter)}')),
+        ('api', 'GET /api/domains/list', lambda: expect_ok(client.get(f'/api/domains/list?username={BENCH_USER}'))),
+        ('api', 'GET /api/domains/export', lambda: expect_ok(client.get(f'/api/domains/export?username={BENCH_USER}'))),
+        ('api', 'GET /api/schedule/status', lambda: expect_ok(client.get(f'/api/schedule/status?username={BENCH_USER}'))),
+        ('api', 'GET /api/auth/check-username', lambda: expect_ok(client.get(f'/api/auth/check-username?username=free{next(counter)}'))),
+        ('api', 'POST /api/auth/login', lambda: expect_ok(client.post('/api/auth/login', json={'username': BENCH_USER, 'password': 'secret'}))),
+        ('data', 'update_domains', lambda: DataManagement.update_domains(results, BENCH_USER)),
+        ('data', 'update_user_task', update_task),
+        # A scratch user, so the bench user's list keeps its size for the other operations
+        ('data', 'add_domains', lambda: DataManagement.add_domains(
+            [f'new-{next(counter)}.example.com' for _ in range(100)], f'{BENCH_USER}-add')),
+        ('data', 'remove_domain', lambda: DataManagement.remove_domain(removable.pop(), BENCH_USER)),
+        ('login', 'registration', lambda: login.registration(f'newuser{next(counter)}', 'secret')),
+    ]
+
+
+def measure(operation, min_time, max_repeats):
+    """ops/s over a timed loop, then one traced call for its allocations"""
+    operation()  # warm caches and lazy imports outside the timed loop
+    repeats, started = 0, time.perf_counter()
+    while True:
+        operation()
+        repeats += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or repeats >= max_repeats:
+            break
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    operation()
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    net_blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    return {
+        'repeats': repeats,
+        'seconds_per_op': round(elapsed / repeats, 6),
+        'ops_per_second': round(repeats / elapsed, 2),
+        'alloc_peak_kb': round(peak / 1024.0, 1),
+        'alloc_net_blocks': net_blocks
+    }
+
+
+def run_scale(scale, groups, min_time, max_repeats, overrides):
+    """Child process body, the repo modules are imported only after the environment is in place"""
+    workdir = tempfile.mkdtemp(prefix=f'storage-bench-{scale}-')
+    prepare_environment(workdir, overrides)
+    from config import Config
+
+    started = time.perf_counter()
+    generate_data(scale)
+    report = {
+        'scale': scale,
+        'setup_seconds': round(time.perf_counter() - started, 3),
+        'config': {key: getattr(Config, key) for key in ('JSON_FLUSH_DELAY', 'USER_INDEX_REFRESH_SECONDS')},
+        'operations': {}
+    }
+    for group, name, operation in operations(scale):
+        if group in groups:
+            report['operations'][name] = dict(measure(operation, min_time, max_repeats), group=group)
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='1000,10000,100000', help='comma separated users/domains/tasks counts')
+    parser.add_argument('--only', default=','.join(GROUPS), help=f"comma separated groups out of {', '.join(GROUPS)}")
+    parser.add_argument('--min-time', type=float, default=1.0, help='seconds each operation is repeated for')
+    # Also bounds remove_domain, which deletes a different stored domain on every call
+    parser.add_argument('--max-repeats', type=int, default=500)
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scales = [int(scale) for scale in args.scales.split(',')]
+    groups = set(args.only.split(','))
+    # One fresh process per scale, so module level caches and peak RSS do not carry over
+    context = multiprocessing.get_context('spawn')
+    runs = []
+    for scale in scales:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            runs.append(executor.submit(run_scale, scale, groups, args.min_time, args.max_repeats, args.env).result())
+    write_report({'benchmark': 'storage_ops', 'min_time': args.min_time, 'runs': runs}, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import csv
+import io
+import json
+from config import logger , Config
+from utils import normalize_host
+from domain_store import insert_domains, iter_domains, DOMAIN_FIELDS
+
+HOST_COLUMNS = ('url', 'domain', 'host')
+EXPORT_FIELDS = ('url',) + DOMAIN_FIELDS
+
+
+def clean_host(value):
+    """Host the way the checker probes it (no scheme, 'www.' or path), lowercased, None when unusable"""
+    if not isinstance(value, str):
+        return None
+    # Lowercased first, so an upper case 'WWW.' prefix is stripped too
+    host = normalize_host(value.strip().lower())
+    if not host or len(host) > 253 or any(char.isspace() for char in host):
+        return None
+    return host
+
+
+def clean_hosts(values):
+    """clean_host over strings or {'url': ...} dicts, unusable values dropped and each host kept once in order"""
+    hosts = (clean_host(value.get('url') if isinstance(value, dict) else value) for value in values)
+    return list(dict.fromkeys(host for host in hosts if host))
+
+
+def iter_csv_values(lines):
+    """First column, or the url/domain/host column when the first row is a header"""
+    column = 0
+    for line_number, row in enumerate(csv.reader(lines)):
+        if not row:
+            continue
+        if line_number == 0:
+            header = [cell.strip().lower() for cell in row]
+            matches = [index for index, cell in enumerate(header) if cell in HOST_COLUMNS]
+            if matches:
+                column = matches[0]
+                continue
+        yield row[column] if column < len(row) else None
+
+
+def iter_ndjson_values(lines):
+    """One JSON string or object with a url/domain/host key per line"""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError:
+            yield None
+            continue
+        if isinstance(value, dict):
+            value = next((value[key] for key in HOST_COLUMNS if key in value), None)
+        yield value
+
+
+def import_domains(stream, username, fmt='csv'):
+    """Parse an uploaded byte stream line by line and store new hosts in batches of IMPORT_BATCH_SIZE
+
+    Only one batch is held in memory, duplicates across batches are dropped by the primary key.
+    """
+    lines = io.TextIOWrapper(stream, encoding='utf-8', errors='replace', newline='')
+    values = iter_ndjson_values(lines) if fmt == 'ndjson' else iter_csv_values(lines)
+    stats = {'total': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0}
+    batch = {}  # dict keeps upload order while deduping inside the batch
+
+    def flush():
+        imported = insert_domains(username, batch)
+        stats['imported'] += imported
+        stats['duplicates'] += len(batch) - imported
+        batch.clear()
+
+    for value in values:
+        stats['total'] += 1
+        host = clean_host(value)
+        if host is None:
+            stats['invalid'] += 1
+        elif host in batch:
+            stats['duplicates'] += 1
+        else:
+            batch[host] = None
+            if len(batch) >= Config.IMPORT_BATCH_SIZE:
+                flush()
+    if batch:
+        flush()
+    logger.info(f"Imported {stats['imported']} of {stats['total']} domains for {username}")
+    return stats
+
+
+def export_domains(username, fmt='csv'):
+    """Yield the user's domains as CSV or NDJSON chunks, rows go out as they are read"""
+    if fmt == 'ndjson':
+        for domain in iter_domains(username):
+            yield json.dumps(domain) + '\n'
+        return
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for count, domain in enumerate(iter_domains(username), 1):
+        writer.writerow(domain)
+        if count % 1000 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from config import logger , Config
+
+
+class CertificateCache():
+    """Process wide LRU cache of (ssl_status, expiration_date, issuer) keyed by hostname"""
+
+    def __init__(self, ttl, max_size, refresh_before_expiry):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.refresh_before_expiry = refresh_before_expiry
+        self._entries = OrderedDict()  # hostname -> (expires_at, cert_info)
+        self._lock = threading.Lock()
+
+    def get(self, hostname):
+        with self._lock:
+            entry = self._entries.get(hostname)
+            if entry is None:
+                return None
+            expires_at, cert_info = entry
+            if expires_at <= time.monotonic():
+                del self._entries[hostname]
+                return None
+            self._entries.move_to_end(hostname)
+            return cert_info
+
+    def put(self, hostname, cert_info):
+        # Failed handshakes are never cached, the next run should retry them
+        if cert_info[0] != 'valid' or self.ttl <= 0 or self.max_size <= 0:
+            return
+        ttl = self.entry_ttl(cert_info[1])
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[hostname] = (time.monotonic() + ttl, cert_info)
+            self._entries.move_to_end(hostname)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def entry_ttl(self, expiration_date):
+        """Shorten the TTL so certificates get re-checked once they get close to expiry"""
+        try:
+            expiry = datetime.strptime(expiration_date, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+        except ValueError:
+            return 0
+        remaining = (expiry - datetime.now(timezone.utc)).total_seconds() - self.refresh_before_expiry
+        return min(self.ttl, remaining)
+
+    def invalidate(self, hostname=None):
+        with self._lock:
+            if hostname is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(hostname, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+certificate_cache = CertificateCache(
+    ttl=Config.CERT_CACHE_TTL,
+    max_size=Config.CERT_CACHE_MAX_SIZE,
+    refresh_before_expiry=Config.CERT_CACHE_REFRESH_DAYS * 86400
+)
+logger.debug(f"Certificate cache ready (ttl={Config.CERT_CACHE_TTL}s, size={Config.CERT_CACHE_MAX_SIZE})")
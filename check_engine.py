@@ -0,0 +1,9 @@
+from config import Config
+
+# The engine picked by CHECK_ENGINE, shared by the API routes and the scheduled jobs
+if Config.CHECK_ENGINE == 'async':
+    from domains_check_async import check_url_async as check_url, iter_check_url_async as iter_check_url
+elif Config.CHECK_ENGINE == 'sharded':
+    from domains_check_sharded import check_url_sharded as check_url, iter_check_url_sharded as iter_check_url
+else:
+    from domains_check_MT import check_url_mt as check_url, iter_check_url_mt as iter_check_url
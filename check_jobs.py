@@ -0,0 +1,108 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from config import logger
+from DataManagement import update_domains
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class CheckJob():
+    def __init__(self, username, domains, probe_mode=None):
+        self.job_id = uuid.uuid4().hex
+        self.username = username
+        self.domains = domains
+        self.probe_mode = probe_mode
+        self.total = len(domains)
+        self.status = 'queued'
+        self.error = None
+        self.results = []
+        self.ok = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def snapshot(self, offset=None):
+        """Progress counts, plus the results from offset onwards when offset is given"""
+        data = {
+            'job_id': self.job_id,
+            'status': self.status,
+            'total': self.total,
+            'completed': len(self.results),
+            'ok': self.ok,
+            'failed': len(self.results) - self.ok,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+        if self.error:
+            data['error'] = self.error
+        if offset is not None:
+            # Results are only ever appended, so a slice is a consistent partial view
+            data['results'] = self.results[offset:]
+        return data
+
+
+class CheckJobManager():
+    """Runs domain checks in a bounded background pool and keeps finished jobs for a retention window"""
+
+    def __init__(self, iter_check, max_workers, max_queued, retention):
+        self.iter_check = iter_check
+        self.max_queued = max_queued
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='check-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, username, domains, probe_mode=None):
+        with self._lock:
+            self._evict_expired()
+            pending = self.pending()
+            if pending >= self.max_queued:
+                raise JobQueueFull(f"{pending} check jobs are already pending")
+            job = CheckJob(username, domains, probe_mode)
+            self._jobs[job.job_id] = job
+        self._executor.submit(self._run, job)
+        logger.info(f"Queued check job {job.job_id} with {job.total} domains for {username}")
+        return job
+
+    def pending(self):
+        return sum(1 for job in list(self._jobs.values()) if job.status in ('queued', 'running'))
+
+    def get(self, job_id):
+        with self._lock:
+            self._evict_expired()
+            return self._jobs.get(job_id)
+
+    def list(self, username):
+        with self._lock:
+            self._evict_expired()
+            return [job for job in self._jobs.values() if job.username == username]
+
+    def _run(self, job):
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            for result in self.iter_check(job.domains, job.username, probe_mode=job.probe_mode):
+                if result['status_code'] == 'OK':
+                    job.ok += 1
+                job.results.append(result)
+            update_domains(job.results, job.username)
+            job.status = 'done'
+        except Exception as e:
+            logger.error(f"Check job {job.job_id} failed: {str(e)}")
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            job.domains = None
+            logger.info(f"Check job {job.job_id} {job.status} after {job.finished_at - job.started_at:.2f}s")
+
+    def _evict_expired(self):
+        cutoff = time.time() - self.retention
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,49 @@
+import time
+from datetime import datetime, timezone
+from config import logger , Config
+from domain_store import fetch_check_state
+
+# A scheduled run fires a little after the previous one stored its results, treat
+# domains that are due within this share of their interval as due now
+DUE_TOLERANCE = 0.1
+
+
+def recheck_interval(status_code, ssl_status, expiration_date, now=None):
+    """Seconds a stored result stays trustworthy, shorter for failures and certificates close to expiry"""
+    if status_code != 'OK' or ssl_status != 'valid':
+        return Config.RECHECK_FAILED_SECONDS
+    try:
+        expires_at = datetime.strptime(expiration_date, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return Config.RECHECK_FAILED_SECONDS
+    if expires_at - (now or time.time()) <= Config.CERT_EXPIRING_DAYS * 86400:
+        return Config.RECHECK_EXPIRING_SECONDS
+    return Config.RECHECK_HEALTHY_SECONDS
+
+
+def due_domains(username, domains, job_interval=None, now=None):
+    """The subset of domains whose stored result is missing or older than its recheck interval
+
+    job_interval (seconds) caps every recheck interval, so a schedule still probes each domain
+    once per run unless it was already verified since the previous one.
+    """
+    if not Config.INCREMENTAL_CHECKS:
+        return list(domains)
+    now = now or time.time()
+    state = fetch_check_state(username)
+    due = []
+    for url in domains:
+        stored = state.get(url)
+        if stored is None or stored[3] is None:
+            due.append(url)
+            continue
+        status_code, ssl_status, expiration_date, last_checked = stored
+        age = now - last_checked
+        interval = recheck_interval(status_code, ssl_status, expiration_date, now)
+        if job_interval:
+            interval = min(interval, job_interval)
+        interval = max(Config.RECHECK_FRESH_SECONDS, interval)
+        if age >= interval * (1 - DUE_TOLERANCE):
+            due.append(url)
+    logger.info(f"{len(due)} of {len(domains)} domains due for {username}")
+    return due
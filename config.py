@@ -22,10 +22,74 @@ class Config:
     HTTP_TIMEOUT = int(os.getenv('HTTP_TIMEOUT'))
     SSL_TIMEOUT = int(os.getenv('SSL_TIMEOUT'))
     OVERALL_CHECK_TIMEOUT = int(os.getenv('OVERALL_CHECK_TIMEOUT'))
+    DOMAIN_CHECK_TIMEOUT = int(os.getenv('DOMAIN_CHECK_TIMEOUT', 10))  # per domain, counted from when its probe starts
+    CHECK_ENGINE = os.getenv('CHECK_ENGINE', 'threads').lower()  # 'threads', 'async' or 'sharded'
+    SHARD_ENGINE = os.getenv('SHARD_ENGINE', 'async').lower()  # engine each sharded worker process runs
+    CHECK_PROCESSES = int(os.getenv('CHECK_PROCESSES', 0))  # 0 means one per CPU
+    CHECK_SHARDS = int(os.getenv('CHECK_SHARDS', 0))  # 0 means four per process
+    SHARDED_MIN_DOMAINS = int(os.getenv('SHARDED_MIN_DOMAINS', 1000))  # smaller lists stay in-process
+    ASYNC_CONCURRENCY = int(os.getenv('ASYNC_CONCURRENCY', 256))  # async probes wait while the process holds this many limiter slots
+    MAX_REDIRECTS = int(os.getenv('MAX_REDIRECTS', 10))
+    CERT_CACHE_TTL = int(os.getenv('CERT_CACHE_TTL', 21600))  # seconds, 0 disables the cache
+    CERT_CACHE_MAX_SIZE = int(os.getenv('CERT_CACHE_MAX_SIZE', 10000))
+    CERT_CACHE_REFRESH_DAYS = int(os.getenv('CERT_CACHE_REFRESH_DAYS', 7))
+    PROBE_REUSE_WINDOW = int(os.getenv('PROBE_REUSE_WINDOW', 300))  # seconds a scheduled check may reuse another user's probe
+    PROBE_REUSE_MAX_ENTRIES = int(os.getenv('PROBE_REUSE_MAX_ENTRIES', 50000))
+    ADAPTIVE_CONCURRENCY = os.getenv('ADAPTIVE_CONCURRENCY', 'True').lower() == 'true'  # False pins the limit at MAX_WORKERS
+    ADAPTIVE_MIN_CONCURRENCY = int(os.getenv('ADAPTIVE_MIN_CONCURRENCY', 8))
+    ADAPTIVE_INITIAL_CONCURRENCY = int(os.getenv('ADAPTIVE_INITIAL_CONCURRENCY', 64))
+    ADAPTIVE_STEP = int(os.getenv('ADAPTIVE_STEP', 8))  # added to the limit after each healthy window
+    ADAPTIVE_BACKOFF = float(os.getenv('ADAPTIVE_BACKOFF', 0.5))  # limit multiplier when timeouts spike
+    ADAPTIVE_WINDOW = int(os.getenv('ADAPTIVE_WINDOW', 20))  # probes per adjustment
+    ADAPTIVE_LATENCY_TARGET = float(os.getenv('ADAPTIVE_LATENCY_TARGET', 1.0))  # seconds
+    ADAPTIVE_ERROR_THRESHOLD = float(os.getenv('ADAPTIVE_ERROR_THRESHOLD', 0.5))
+    ADAPTIVE_TIMEOUT_THRESHOLD = float(os.getenv('ADAPTIVE_TIMEOUT_THRESHOLD', 0.1))
+    DESTINATION_MAX_CONCURRENCY = int(os.getenv('DESTINATION_MAX_CONCURRENCY', 32))  # per /24 (IPv4) or /48 (IPv6)
+    DNS_CACHE_TTL = int(os.getenv('DNS_CACHE_TTL', 300))
+    DNS_NEGATIVE_TTL = int(os.getenv('DNS_NEGATIVE_TTL', 30))
+    DNS_CACHE_MAX_SIZE = int(os.getenv('DNS_CACHE_MAX_SIZE', 50000))
+    DNS_RESOLVER_WORKERS = int(os.getenv('DNS_RESOLVER_WORKERS', 64))
+    HTTP_POOL_HOSTS = int(os.getenv('HTTP_POOL_HOSTS', 1000))
+    HTTP_POOL_PER_HOST = int(os.getenv('HTTP_POOL_PER_HOST', 4))
+    HTTP_REUSE_TLS_CONNECTION = os.getenv('HTTP_REUSE_TLS_CONNECTION', 'False').lower() == 'true'
+    PROBE_MODE = os.getenv('PROBE_MODE', 'get').lower()  # 'get', 'stream' or 'head'
+    PROBE_MAX_BODY_BYTES = int(os.getenv('PROBE_MAX_BODY_BYTES', 0))  # body bytes read in 'stream' and 'head' modes
+    PROBE_HTTP_PORT = int(os.getenv('PROBE_HTTP_PORT', 80))  # only changed to point the checker at a local test farm
+    PROBE_HTTPS_PORT = int(os.getenv('PROBE_HTTPS_PORT', 443))
+    CHECK_JOB_WORKERS = int(os.getenv('CHECK_JOB_WORKERS', 4))
+    CHECK_JOB_MAX_QUEUED = int(os.getenv('CHECK_JOB_MAX_QUEUED', 100))
+    CHECK_JOB_RETENTION = int(os.getenv('CHECK_JOB_RETENTION', 3600))  # seconds a finished job stays pollable
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 512))  # serialized list/status responses kept in memory
+    RESPONSE_GZIP = os.getenv('RESPONSE_GZIP', 'True').lower() == 'true'
+    RESPONSE_GZIP_MIN_BYTES = int(os.getenv('RESPONSE_GZIP_MIN_BYTES', 1024))  # smaller bodies are sent as is
+    RESPONSE_GZIP_LEVEL = int(os.getenv('RESPONSE_GZIP_LEVEL', 6))
+    DOMAIN_PAGE_SIZE = int(os.getenv('DOMAIN_PAGE_SIZE', 100))  # /api/domains/list page size when limit is not given
+    DOMAIN_PAGE_MAX = int(os.getenv('DOMAIN_PAGE_MAX', 1000))
+
+    # Scheduled Check Configuration
+    INCREMENTAL_CHECKS = os.getenv('INCREMENTAL_CHECKS', 'True').lower() == 'true'  # False re-checks every domain on each run
+    RECHECK_FRESH_SECONDS = int(os.getenv('RECHECK_FRESH_SECONDS', 300))  # nothing checked more recently is probed again
+    RECHECK_FAILED_SECONDS = int(os.getenv('RECHECK_FAILED_SECONDS', 900))
+    RECHECK_EXPIRING_SECONDS = int(os.getenv('RECHECK_EXPIRING_SECONDS', 3600))
+    RECHECK_HEALTHY_SECONDS = int(os.getenv('RECHECK_HEALTHY_SECONDS', 21600))  # a schedule's own interval caps all RECHECK_* values
+    CERT_EXPIRING_DAYS = int(os.getenv('CERT_EXPIRING_DAYS', 14))  # certificates closer to expiry count as expiring
+    SCHEDULER_WORKERS = int(os.getenv('SCHEDULER_WORKERS', 4))  # scheduled jobs running at once
+    SCHEDULER_MISFIRE_GRACE = int(os.getenv('SCHEDULER_MISFIRE_GRACE', 3600))  # seconds a late run may still start
+    SCHEDULER_STARTUP_SPREAD = int(os.getenv('SCHEDULER_STARTUP_SPREAD', 300))  # seconds overdue jobs are spread over at startup
+    SCHEDULE_SPREAD_WINDOW = int(os.getenv('SCHEDULE_SPREAD_WINDOW', 3600))  # seconds per-user jitter spreads runs over, 0 disables it
+    SCHEDULED_CHECK_CONCURRENCY = int(os.getenv('SCHEDULED_CHECK_CONCURRENCY', 2))  # scheduled checks probing at once, others queue
     
     # File Storage Configuration
     JSON_DIRECTORY = os.getenv('JSON_DIRECTORY')
     LOGS_DIRECTORY = os.getenv('LOGS_DIRECTORY')
+    SQLITE_PATH = os.getenv('SQLITE_PATH')  # defaults to JSON_DIRECTORY/domains.db
+    USER_INDEX_REFRESH_SECONDS = int(os.getenv('USER_INDEX_REFRESH_SECONDS', 5))  # how often users.json mtime is re-checked
+    JSON_FLUSH_DELAY = float(os.getenv('JSON_FLUSH_DELAY', 0.5))  # seconds task file writes are coalesced, 0 writes through
+    IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 5000))  # domains per insert transaction during bulk import
+    DOMAIN_VIEW_MAX_USERS = int(os.getenv('DOMAIN_VIEW_MAX_USERS', 256))  # users whose domain list scheduled jobs keep in memory
+    HISTORY_RETENTION_DAYS = int(os.getenv('HISTORY_RETENTION_DAYS', 30))  # raw per-check history
+    HISTORY_ROLLUP_RETENTION_DAYS = int(os.getenv('HISTORY_ROLLUP_RETENTION_DAYS', 400))  # hourly uptime rollups and certificate events
+    HISTORY_PRUNE_INTERVAL = int(os.getenv('HISTORY_PRUNE_INTERVAL', 3600))  # seconds between retention sweeps
     
     # Logging Configuration
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
@@ -0,0 +1,101 @@
+import asyncio
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from config import logger , Config
+from metrics import timed, CHECK_FAILURES
+
+
+class ResolverCache():
+    """Resolves each host once and shares the answer between the TLS and HTTP probes
+
+    getaddrinfo does not expose record TTLs, so answers live for DNS_CACHE_TTL seconds and
+    failures for DNS_NEGATIVE_TTL seconds.
+    """
+
+    def __init__(self, ttl, negative_ttl, max_entries, workers):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # host -> (expires_at, addresses or exception)
+        self._inflight = {}  # host -> Future of the lookup currently running
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dns')
+
+    def resolve(self, host):
+        """Return the list of IP addresses for host, raising socket.gaierror when it does not resolve"""
+        return self._lookup(host).result()
+
+    def prefetch(self, hosts):
+        """Start resolving a whole batch in the background, probes pick the answers up as they land"""
+        for host in set(hosts):
+            self._lookup(host)
+
+    def create_connection(self, host, port, timeout):
+        """socket.create_connection over the cached addresses, each tried in turn until one connects"""
+        error = None
+        for address in self.resolve(host):
+            try:
+                return socket.create_connection((address, port), timeout=timeout)
+            except OSError as e:
+                error = e
+        raise error
+
+    async def resolve_async(self, host):
+        return await asyncio.wrap_future(self._lookup(host))
+
+    def _lookup(self, host):
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry is not None:
+                expires_at, answer = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(host)
+                    future = Future()
+                    if isinstance(answer, Exception):
+                        future.set_exception(answer)
+                    else:
+                        future.set_result(answer)
+                    return future
+                del self._entries[host]
+            future = self._inflight.get(host)
+            if future is not None:
+                return future
+            future = self._executor.submit(self._getaddrinfo, host)
+            self._inflight[host] = future
+        # Outside the lock, the callback runs right here if the lookup already finished
+        future.add_done_callback(lambda future: self._store(host, future))
+        return future
+
+    def _getaddrinfo(self, host):
+        with timed('dns'):
+            try:
+                infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+            except socket.gaierror:
+                CHECK_FAILURES.inc(phase='dns')
+                raise
+        # Keep getaddrinfo's preference order, without duplicates
+        return list(dict.fromkeys(info[4][0] for info in infos))
+
+    def _store(self, host, future):
+        error = future.exception()
+        answer, ttl = (error, self.negative_ttl) if error else (future.result(), self.ttl)
+        with self._lock:
+            self._inflight.pop(host, None)
+            if ttl > 0:
+                self._entries[host] = (time.monotonic() + ttl, answer)
+                self._entries.move_to_end(host)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        if error:
+            logger.debug(f"DNS lookup failed for {host}: {error}")
+
+
+dns_cache = ResolverCache(
+    ttl=Config.DNS_CACHE_TTL,
+    negative_ttl=Config.DNS_NEGATIVE_TTL,
+    max_entries=Config.DNS_CACHE_MAX_SIZE,
+    workers=Config.DNS_RESOLVER_WORKERS
+)
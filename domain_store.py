@@ -0,0 +1,374 @@
+import os
+import json
+import base64
+import sqlite3
+import threading
+from contextlib import contextmanager
+from config import logger , Config
+
+DOMAIN_FIELDS = ('status_code', 'ssl_status', 'expiration_date', 'issuer')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS domains (
+    username TEXT NOT NULL,
+    url TEXT NOT NULL,
+    status_code TEXT NOT NULL DEFAULT 'FAILED',
+    ssl_status TEXT NOT NULL DEFAULT 'unknown',
+    expiration_date TEXT NOT NULL DEFAULT 'unknown',
+    issuer TEXT NOT NULL DEFAULT 'unknown',
+    last_checked REAL,
+    PRIMARY KEY (username, url)
+);
+-- Pages of the list, every index entry also carries the rowid used as keyset tiebreaker
+CREATE INDEX IF NOT EXISTS domains_user ON domains (username);
+CREATE INDEX IF NOT EXISTS domains_user_expiration ON domains (username, expiration_date);
+CREATE INDEX IF NOT EXISTS domains_user_status ON domains (username, status_code, expiration_date);
+CREATE INDEX IF NOT EXISTS domains_user_ssl ON domains (username, ssl_status, expiration_date);
+CREATE INDEX IF NOT EXISTS domains_user_issuer ON domains (username, issuer, expiration_date);
+CREATE TABLE IF NOT EXISTS domain_versions (
+    username TEXT PRIMARY KEY,
+    data_version INTEGER NOT NULL DEFAULT 0,
+    membership_version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS known_certs (
+    username TEXT NOT NULL,
+    url TEXT NOT NULL,
+    ssl_status TEXT NOT NULL,
+    expiration_date TEXT NOT NULL,
+    issuer TEXT NOT NULL,
+    PRIMARY KEY (username, url)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS check_history (
+    username TEXT NOT NULL,
+    url TEXT NOT NULL,
+    checked_at INTEGER NOT NULL,
+    status_code TEXT NOT NULL,
+    ssl_status TEXT NOT NULL,
+    expiration_date TEXT NOT NULL,
+    PRIMARY KEY (username, url, checked_at)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS check_history_checked_at ON check_history (checked_at);
+CREATE TABLE IF NOT EXISTS check_rollups (
+    username TEXT NOT NULL,
+    url TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    checks INTEGER NOT NULL,
+    ok INTEGER NOT NULL,
+    PRIMARY KEY (username, url, hour)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS check_rollups_hour ON check_rollups (hour);
+CREATE TABLE IF NOT EXISTS cert_events (
+    username TEXT NOT NULL,
+    url TEXT NOT NULL,
+    changed_at INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    old_expiration TEXT,
+    new_expiration TEXT,
+    old_issuer TEXT,
+    new_issuer TEXT
+);
+CREATE INDEX IF NOT EXISTS cert_events_user_time ON cert_events (username, changed_at);
+CREATE TABLE IF NOT EXISTS migrations (
+    name TEXT PRIMARY KEY,
+    applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+UPSERT_DOMAIN = """
+INSERT INTO domains (username, url, status_code, ssl_status, expiration_date, issuer, last_checked)
+VALUES (?, ?, COALESCE(?, 'FAILED'), COALESCE(?, 'unknown'), COALESCE(?, 'unknown'), COALESCE(?, 'unknown'), ?)
+ON CONFLICT (username, url) DO UPDATE SET
+    status_code = COALESCE(?, status_code),
+    ssl_status = COALESCE(?, ssl_status),
+    expiration_date = COALESCE(?, expiration_date),
+    issuer = COALESCE(?, issuer),
+    last_checked = COALESCE(?, last_checked)
+"""
+
+# data_version moves on every write, membership_version only when domains are added or removed
+BUMP_VERSION = """
+INSERT INTO domain_versions (username, data_version, membership_version) VALUES (?, 1, ?)
+ON CONFLICT (username) DO UPDATE SET
+    data_version = data_version + 1,
+    membership_version = membership_version + excluded.membership_version
+"""
+
+_local = threading.local()
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+def database_path():
+    if Config.SQLITE_PATH:
+        return Config.SQLITE_PATH
+    json_dir = Config.JSON_DIRECTORY
+    if not os.path.exists(json_dir):
+        os.makedirs(json_dir)
+    return os.path.join(json_dir, 'domains.db')
+
+
+def get_connection():
+    """One connection per thread, WAL lets readers run alongside the writer"""
+    path = database_path()
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.path == path:
+        return conn
+
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _local.conn, _local.path = conn, path
+
+    with _init_lock:
+        if path not in _initialized:
+            conn.executescript(SCHEMA)
+            migrate_schema(conn)
+            migrate_json_domains(conn)
+            _initialized.add(path)
+    return conn
+
+
+def fetch_domains(username):
+    rows = get_connection().execute(
+        "SELECT url, status_code, ssl_status, expiration_date, issuer FROM domains WHERE username = ? ORDER BY rowid",
+        (username,)
+    )
+    return [dict(row) for row in rows]
+
+
+def encode_cursor(sort, after):
+    return base64.urlsafe_b64encode(json.dumps([sort, *after]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort):
+    """The (sort value..., rowid) a page ended on, ValueError when the cursor is bad or from another sort"""
+    try:
+        token = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(token, list) or not token or token[0] != sort:
+        raise ValueError("Cursor does not belong to this sort order")
+    return tuple(token[1:])
+
+
+def query_domains(username, filters=None, sort=None, cursor=None, limit=100):
+    """One page of a user's domains and the cursor of the next page (None on the last one)
+
+    filters maps status_code / ssl_status / issuer to allowed values and expires_before to a
+    "%Y-%m-%d %H:%M:%S" bound, sort is None, 'expiration_date' or '-expiration_date'. Without a
+    sort the order is insertion order, or expiration_date as soon as a filter is given, the order
+    the (username, ..., expiration_date) indexes serve. Pages are keyset based on (sort column,
+    rowid), so each one is an index range read whatever its depth. In insertion order rows written
+    between pages are neither skipped nor repeated, by expiry a row whose expiration_date changes
+    between pages can move across the cursor and be skipped or returned twice.
+    """
+    filters = filters or {}
+    if not sort and any(filters.values()):
+        sort = 'expiration_date'
+
+    where, params = ["username = ?"], [username]
+    for column in ('status_code', 'ssl_status', 'issuer'):
+        values = filters.get(column)
+        if values:
+            where.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+    if filters.get('expires_before'):
+        # 'unknown' sorts after every date, so domains without a certificate never match
+        where.append("expiration_date < ?")
+        params.append(filters['expires_before'])
+
+    descending = bool(sort) and sort.startswith('-')
+    columns = ['expiration_date', 'rowid'] if sort else ['rowid']
+    if cursor:
+        after = decode_cursor(cursor, sort)
+        if len(after) != len(columns):
+            raise ValueError("Invalid cursor")
+        where.append(f"({', '.join(columns)}) {'<' if descending else '>'} ({', '.join('?' * len(columns))})")
+        params.extend(after)
+    order = ', '.join(f"{column} {'DESC' if descending else 'ASC'}" for column in columns)
+
+    rows = get_connection().execute(
+        f"SELECT rowid, url, status_code, ssl_status, expiration_date, issuer FROM domains "
+        f"WHERE {' AND '.join(where)} ORDER BY {order} LIMIT ?",
+        params + [limit + 1]
+    ).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(sort, [rows[-1][column] for column in columns])
+    return [{key: row[key] for key in ('url',) + DOMAIN_FIELDS} for row in rows], next_cursor
+
+
+def fetch_urls(username):
+    rows = get_connection().execute("SELECT url FROM domains WHERE username = ? ORDER BY rowid", (username,))
+    return [row['url'] for row in rows]
+
+
+def fetch_versions(username):
+    """(data_version, membership_version) of a user's domains, (0, 0) before the first write"""
+    row = get_connection().execute(
+        "SELECT data_version, membership_version FROM domain_versions WHERE username = ?", (username,)
+    ).fetchone()
+    return tuple(row) if row else (0, 0)
+
+
+def fetch_check_state(username):
+    """url -> (status_code, ssl_status, expiration_date, last_checked), what the incremental planner needs"""
+    rows = get_connection().execute(
+        "SELECT url, status_code, ssl_status, expiration_date, last_checked FROM domains WHERE username = ?",
+        (username,)
+    )
+    return {row['url']: tuple(row)[1:] for row in rows}
+
+
+def upsert_params(username, domain, checked_at=None):
+    values = [domain.get(field) for field in DOMAIN_FIELDS] + [checked_at]
+    return (username, domain['url'], *values, *values)
+
+
+def chunked(values, size=500):
+    """Slices of at most size items, keeps IN (...) lists under SQLite's bound parameter limit"""
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def existing_urls(conn, username, urls):
+    """The subset of urls already stored for username, primary key lookups only"""
+    found = set()
+    for chunk in chunked(urls):
+        rows = conn.execute(
+            f"SELECT url FROM domains WHERE username = ? AND url IN ({', '.join('?' * len(chunk))})",
+            [username, *chunk]
+        )
+        found.update(row['url'] for row in rows)
+    return found
+
+
+def write_domains(conn, username, domains, checked_at=None):
+    """upsert_domains without its own transaction, for callers that write more in the same one"""
+    params = [upsert_params(username, domain, checked_at) for domain in domains]
+    urls = {domain['url'] for domain in domains}
+    added = len(urls) != len(existing_urls(conn, username, urls))
+    conn.executemany(UPSERT_DOMAIN, params)
+    conn.execute(BUMP_VERSION, (username, int(added)))
+    return len(params)
+
+
+def upsert_domains(username, domains, checked_at=None):
+    """Insert or update every domain in a single transaction, checked_at stamps them as freshly probed"""
+    conn = get_connection()
+    with transaction(conn):
+        return write_domains(conn, username, domains, checked_at)
+
+
+def insert_domains(username, urls):
+    """Add urls that are not stored yet, existing rows are left untouched. Returns how many were new"""
+    conn = get_connection()
+    with transaction(conn):
+        cursor = conn.executemany(
+            "INSERT OR IGNORE INTO domains (username, url) VALUES (?, ?)", [(username, url) for url in urls]
+        )
+        if cursor.rowcount > 0:
+            conn.execute(BUMP_VERSION, (username, 1))
+    return max(cursor.rowcount, 0)
+
+
+def iter_domains(username):
+    """Stream a user's rows straight off the cursor, for exports that must not build the whole list"""
+    cursor = get_connection().execute(
+        "SELECT url, status_code, ssl_status, expiration_date, issuer FROM domains WHERE username = ? ORDER BY rowid",
+        (username,)
+    )
+    for row in cursor:
+        yield dict(row)
+
+
+def delete_domain(username, url):
+    conn = get_connection()
+    with transaction(conn):
+        cursor = conn.execute("DELETE FROM domains WHERE username = ? AND url = ?", (username, url))
+        # A domain added again later starts without a known certificate
+        conn.execute("DELETE FROM known_certs WHERE username = ? AND url = ?", (username, url))
+        if cursor.rowcount:
+            conn.execute(BUMP_VERSION, (username, 1))
+    return cursor.rowcount > 0
+
+
+@contextmanager
+def transaction(conn):
+    """BEGIN IMMEDIATE / COMMIT around a block, rolled back on error"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+# Certificates already stored count as known, so importing them does not log an 'issued' event each
+SEED_KNOWN_CERTS = """
+INSERT OR IGNORE INTO known_certs (username, url, ssl_status, expiration_date, issuer)
+SELECT username, url, ssl_status, expiration_date, issuer FROM domains
+"""
+
+
+def migrate_schema(conn):
+    """Add columns introduced after the first release to an existing database"""
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(domains)")}
+    if 'last_checked' not in columns:
+        conn.execute("ALTER TABLE domains ADD COLUMN last_checked REAL")
+        logger.info("Added last_checked column to the domains table")
+    if not conn.execute("SELECT 1 FROM migrations WHERE name = 'known_certs'").fetchone():
+        with transaction(conn):
+            conn.execute(SEED_KNOWN_CERTS + " WHERE ssl_status != 'unknown'")
+            conn.execute("INSERT OR REPLACE INTO migrations (name) VALUES ('known_certs')")
+
+
+def is_storable(domain):
+    """A legacy entry with a non-empty url and plain values SQLite can bind"""
+    if not isinstance(domain, dict) or not isinstance(domain.get('url'), str) or not domain['url'].strip():
+        return False
+    return all(isinstance(domain.get(field), (str, int, float, type(None))) for field in DOMAIN_FIELDS)
+
+
+def migrate_json_domains(conn=None, json_dir=None, force=False):
+    """One-shot import of the legacy {username}_domains.json files, the files are left in place"""
+    conn = conn or get_connection()
+    json_dir = json_dir or Config.JSON_DIRECTORY
+    if not force and conn.execute("SELECT 1 FROM migrations WHERE name = 'json_domains'").fetchone():
+        return 0
+
+    migrated = 0
+    suffix = '_domains.json'
+    with transaction(conn):
+        for file_name in sorted(os.listdir(json_dir)) if os.path.isdir(json_dir) else []:
+            if not file_name.endswith(suffix):
+                continue
+            username = file_name[:-len(suffix)]
+            try:
+                with open(os.path.join(json_dir, file_name), 'r') as f:
+                    domains = json.load(f).get("domains", [])
+            except Exception as e:
+                logger.error(f"Skipping {file_name} during migration: {e}")
+                continue
+            params = []
+            for domain in domains if isinstance(domains, list) else []:
+                if not is_storable(domain):
+                    # One bad entry must not stop the migration, it would then rerun and fail on every connection
+                    logger.warning(f"Skipping malformed entry in {file_name}: {domain!r}")
+                    continue
+                params.append(upsert_params(username, domain))
+            conn.executemany(UPSERT_DOMAIN, params)
+            conn.execute(SEED_KNOWN_CERTS + " WHERE ssl_status != 'unknown' AND username = ?", (username,))
+            migrated += len(params)
+            logger.info(f"Migrated {len(params)} domains for {username} from {file_name}")
+        conn.execute("INSERT OR REPLACE INTO migrations (name) VALUES ('json_domains')")
+    return migrated
+
+
+if __name__ == '__main__':
+    count = migrate_json_domains(force=True)
+    print(f"Migrated {count} domains into {database_path()}")
@@ -0,0 +1,38 @@
+import threading
+from collections import OrderedDict
+from config import logger , Config
+from domain_store import fetch_urls, fetch_versions
+
+
+class DomainListView():
+    """Per-user domain lists for scheduled jobs, reloaded only after domains were added or removed
+
+    Each lookup costs one primary-key read of the user's membership version, the list itself
+    comes from memory while that version is unchanged. At most max_users lists are kept.
+    """
+
+    def __init__(self, max_users):
+        self.max_users = max_users
+        self._entries = OrderedDict()  # username -> (membership_version, tuple of urls)
+        self._lock = threading.Lock()
+
+    def urls(self, username):
+        # Read the version first, a list loaded after it is never older than the version it is stored under
+        version = fetch_versions(username)[1]
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(username)
+                return entry[1]
+
+        urls = tuple(fetch_urls(username))
+        with self._lock:
+            self._entries[username] = (version, urls)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        logger.debug(f"Loaded {len(urls)} domains for {username} (membership version {version})")
+        return urls
+
+
+domain_view = DomainListView(max_users=Config.DOMAIN_VIEW_MAX_USERS)
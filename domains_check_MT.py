@@ -1,113 +1,260 @@
 import requests
 import ssl
-import socket
 from datetime import datetime, timezone
 import json
 import concurrent.futures
-from queue import Queue
+import heapq
+from queue import Queue, Empty
 import time
 from config import logger , Config
 from DataManagement import update_domains
 from elasticapm import traces , capture_span
+from utils import normalize_host, probe_url
+from cert_cache import certificate_cache
+from probe_coalescer import probe_coalescer
+from http_client import get_session, peer_certificate, release_response
+from dns_cache import dns_cache
+from adaptive_limiter import limiter, resolve_destination, probe_outcome
+from metrics import timed, PHASE_SECONDS, CHECK_RESULTS, CHECK_FAILURES, CHECK_LOST, QueuedWork
+
+def parse_certificate(cert):
+    """Turn a getpeercert() dict into (ssl_status, expiration_date, issuer)"""
+    expiry_date_str = cert['notAfter']
+    expiry_date = datetime.strptime(expiry_date_str, "%b %d %H:%M:%S %Y %Z").replace(tzinfo=timezone.utc)
+    issuer = dict(x[0] for x in cert['issuer'])
+    return ('valid', expiry_date.strftime("%Y-%m-%d %H:%M:%S"), issuer.get('commonName', 'unknown'))
 
 def check_certificate(url):
+    cached = certificate_cache.get(url)
+    if cached:
+        return cached
     try:
         context = ssl.create_default_context()
-        with socket.create_connection((url, 443), timeout=Config.SSL_TIMEOUT) as sock:
-            with context.wrap_socket(sock, server_hostname=url) as ssock:
+        with timed('connect'):
+            sock = dns_cache.create_connection(url, Config.PROBE_HTTPS_PORT, timeout=Config.SSL_TIMEOUT)
+        with sock:
+            with timed('tls'):
+                ssock = context.wrap_socket(sock, server_hostname=url)
+            with ssock:
                 cert = ssock.getpeercert()
 
-        expiry_date_str = cert['notAfter']
-        expiry_date = datetime.strptime(expiry_date_str, "%b %d %H:%M:%S %Y %Z").replace(tzinfo=timezone.utc)
-        issuer = dict(x[0] for x in cert['issuer'])
-        return ('valid', expiry_date.strftime("%Y-%m-%d %H:%M:%S"), issuer.get('commonName', 'unknown'))
+        cert_info = parse_certificate(cert)
+        certificate_cache.put(url, cert_info)
+        return cert_info
     except Exception as e:
+        CHECK_FAILURES.inc(phase='certificate')
         return ('failed', 'unknown', 'unknown')
 
-def check_url_mt(domains, username, apm_context):
-    # Create request-specific queues
-    request_urls_queue = Queue()
-    request_analyzed_queue = Queue()
-    
-    # Add domains to THIS request's queue
-    for domain in domains:
-        if isinstance(domain, dict) and 'url' in domain:
-            request_urls_queue.put(domain['url'])
-        else:
-            request_urls_queue.put(domain)
-    
-    expected_count = request_urls_queue.qsize()
-    logger.info(f"Added {expected_count} domains to queue for {username}")
-    
-    max_workers = min(Config.MAX_WORKERS, len(domains) * 2)
-    
-    def check_url(apm_context):
+def probe_host(url, probe_mode=None):
+    """Run the TLS and HTTP probes for one normalized host and return the result fields"""
+    probe_mode = probe_mode or Config.PROBE_MODE
+    fields = {
+        'status_code': 'FAILED',
+        'ssl_status': 'unknown',
+        'expiration_date': 'unknown',
+        'issuer': 'unknown'
+    }
+    if Config.HTTP_REUSE_TLS_CONNECTION:
+        # HTTP first, the certificate comes from the https connection it ended on when possible
+        http_status, cert_info = fetch_status(url, probe_mode, read_certificate=True)
+        if http_status == 200:
+            ssl_status, expiry_date, issuer_name = cert_info or check_certificate(url)
+            fields.update({
+                'status_code': 'OK',
+                'ssl_status': ssl_status,
+                'expiration_date': expiry_date,
+                'issuer': issuer_name
+            })
+        return fields
+
+    # Run SSL and HTTP checks concurrently
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        ssl_future = executor.submit(check_certificate, url)
+        http_future = executor.submit(fetch_status, url, probe_mode)
+
+        ssl_status, expiry_date, issuer_name = ssl_future.result(timeout=Config.SSL_TIMEOUT)
+        http_status, _ = http_future.result(timeout=Config.HTTP_TIMEOUT)
+
+        if http_status == 200:
+            fields.update({
+                'status_code': 'OK',
+                'ssl_status': ssl_status,
+                'expiration_date': expiry_date,
+                'issuer': issuer_name
+            })
+    return fields
+
+def fetch_status(url, probe_mode, read_certificate=False):
+    """Return (status_code, cert_info) for probe_url(url) through the pooled session
+
+    'get' downloads the whole body, 'stream' reads at most PROBE_MAX_BODY_BYTES of it and
+    'head' tries HEAD first, falling back to a streamed GET when HEAD does not answer 200.
+    cert_info is only set when read_certificate is on and the redirects ended on https.
+    """
+    session = get_session()
+    if probe_mode == 'head':
+        try:
+            with timed('first_byte'):
+                response = session.head(probe_url(url), timeout=Config.HTTP_TIMEOUT, allow_redirects=True, stream=True)
+            try:
+                if response.status_code == 200:
+                    return 200, connection_certificate(response, url) if read_certificate else None
+            finally:
+                release_response(response)
+        except requests.exceptions.Timeout:
+            raise
+        except requests.exceptions.RequestException as e:
+            logger.debug(f"HEAD failed for {url}, falling back to GET: {e}")
+
+    with timed('first_byte'):
+        response = session.get(probe_url(url), timeout=Config.HTTP_TIMEOUT, stream=True)
+    try:
+        return response.status_code, connection_certificate(response, url) if read_certificate else None
+    finally:
+        release_response(response, None if probe_mode == 'get' else Config.PROBE_MAX_BODY_BYTES)
+
+def connection_certificate(response, url):
+    """Certificate info for url, read off the response's https connection unless already cached"""
+    cert_info = certificate_cache.get(url)
+    if cert_info is None:
+        cert = peer_certificate(response, url)
+        if cert:
+            cert_info = parse_certificate(cert)
+            certificate_cache.put(url, cert_info)
+    return cert_info
+
+def default_result(url, status_code='FAILED'):
+    return {
+        'url': url, 
+        'status_code': status_code, 
+        'ssl_status': 'unknown',
+        'expiration_date': 'unknown', 
+        'issuer': 'unknown'
+    }
+
+def dispatch_checks(urls, username, apm_context=None, max_result_age=0, probe_mode=None):
+    """Yield (index, result) for every url, exactly once, in completion order
+
+    Every url is its own task on a fixed pool and reports into a completion queue. A url
+    whose probe runs longer than DOMAIN_CHECK_TIMEOUT, or that has not finished by
+    OVERALL_CHECK_TIMEOUT, is reported with status_code 'TIMEOUT' instead of being dropped.
+    """
+    if not urls:
+        return
+    expected_count = len(urls)
+    completed = Queue()  # (index, result) from the workers
+    started = Queue()    # (deadline, index) pushed when a worker picks a url up
+
+    def check_url(index, url):
         traces.execution_context.set_transaction(apm_context)
-        while not request_urls_queue.empty():
-            url = request_urls_queue.get()
-            with capture_span(name=url, span_type="cpu"):
-                result = {
-                    'url': url, 
-                    'status_code': 'FAILED', 
-                    'ssl_status': 'unknown',
-                    'expiration_date': 'unknown', 
-                    'issuer': 'unknown'
-                }
-                try:
-                    url = url.replace("https://", "").replace("http://", "").replace("www.", "").split("/")[0]
-                    
-                    # Run SSL and HTTP checks concurrently
-                    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-                        ssl_future = executor.submit(check_certificate, url)
-                        http_future = executor.submit(
-                            requests.get, 
-                            f'http://{url}', 
-                            timeout=Config.HTTP_TIMEOUT
-                        )
-    
-                        ssl_status, expiry_date, issuer_name = ssl_future.result(timeout=Config.SSL_TIMEOUT)
-                        http_response = http_future.result(timeout=Config.HTTP_TIMEOUT)
-    
-                        if http_response.status_code == 200:
-                            result.update({
-                                'status_code': 'OK',
-                                'ssl_status': ssl_status,
-                                'expiration_date': expiry_date,
-                                'issuer': issuer_name
-                            })
-                    
-                    request_analyzed_queue.put(result)
-                except Exception as e:
-                    logger.error(f"Error checking {url}: {str(e)}")
-                    request_analyzed_queue.put(result)
-                finally:
-                    request_urls_queue.task_done()
-
-    results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
-        for _ in range(max_workers):
-            futures.append(executor.submit(check_url,apm_context))
-        
-        done, not_done = concurrent.futures.wait(
-            futures, 
-            timeout=Config.OVERALL_CHECK_TIMEOUT,
-            return_when=concurrent.futures.ALL_COMPLETED
-        )
-        
-        if not_done:
-            logger.warning(f"{len(not_done)} threads did not complete")
-    
-    # Collect results from THIS request's analyzed queue
-    while not request_analyzed_queue.empty():
-        result = request_analyzed_queue.get()
-        results.append(result)
-        request_analyzed_queue.task_done()
-
-    logger.info(f"Expected {expected_count} results, got {len(results)} for {username}")
-    if len(results) < expected_count:
-        logger.warning(f"Lost {expected_count - len(results)} checks for {username}")
+        result = default_result(url)
+        host = normalize_host(url)
+        recent = probe_coalescer.recent(host, max_result_age)
+        if recent is not None:
+            queued.start()
+            result.update(recent)
+            completed.put((index, result))
+            return
+
+        # Wait for the adaptive limiter, the per-domain deadline only starts once a slot is held
+        destination = resolve_destination(host)
+        acquired = limiter.acquire(destination, timeout=max(global_deadline - time.monotonic(), 0))
+        queued.start()
+        if not acquired:
+            return  # the dispatcher reports it as TIMEOUT at the global deadline
+        started.put((time.monotonic() + Config.DOMAIN_CHECK_TIMEOUT, index))
+        probe_started = time.monotonic()
+        with capture_span(name=url, span_type="external"):
+            try:
+                result.update(probe_coalescer.probe(host, lambda host: probe_host(host, probe_mode), max_age=max_result_age))
+            except Exception as e:
+                CHECK_FAILURES.inc(phase='http')
+                logger.error(f"Error checking {url}: {str(e)}")
+            finally:
+                latency = time.monotonic() - probe_started
+                PHASE_SECONDS.observe(latency, phase='total')
+                limiter.release(destination, latency, probe_outcome(result['status_code'], latency))
+        completed.put((index, result))
+
+    # Resolve the whole batch up front and concurrently, both probes then hit the cache
+    dns_cache.prefetch(normalize_host(url) for url in urls)
+
+    # Threads only wait here, the limiter decides how many probes actually run
+    max_workers = min(Config.MAX_WORKERS, expected_count)
+    global_deadline = time.monotonic() + Config.OVERALL_CHECK_TIMEOUT
+    queued = QueuedWork(expected_count)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    for index, url in enumerate(urls):
+        executor.submit(check_url, index, url)
+
+    reported = [False] * expected_count
+    remaining = expected_count
+    deadlines = []  # heap of (deadline, index) for urls being probed
+    timed_out = 0
+    try:
+        while remaining:
+            while not started.empty():
+                heapq.heappush(deadlines, started.get_nowait())
+            now = time.monotonic()
+            # A url that starts while we wait cannot expire before now + DOMAIN_CHECK_TIMEOUT
+            wake_at = min(global_deadline, deadlines[0][0] if deadlines else now + Config.DOMAIN_CHECK_TIMEOUT)
+            try:
+                index, result = completed.get(timeout=max(wake_at - now, 0))
+                if not reported[index]:
+                    reported[index] = True
+                    remaining -= 1
+                    CHECK_RESULTS.inc(status=result['status_code'])
+                    yield index, result
+            except Empty:
+                pass
+
+            now = time.monotonic()
+            while not started.empty():
+                heapq.heappush(deadlines, started.get_nowait())
+            while deadlines and (deadlines[0][0] <= now or now >= global_deadline):
+                _, index = heapq.heappop(deadlines)
+                if not reported[index]:
+                    # The worker thread cannot be interrupted, its late result is simply ignored
+                    reported[index] = True
+                    remaining -= 1
+                    timed_out += 1
+                    CHECK_RESULTS.inc(status='TIMEOUT')
+                    yield index, default_result(urls[index], 'TIMEOUT')
+            if now >= global_deadline:
+                # Urls still waiting for a worker never got a chance to run
+                for index, url in enumerate(urls):
+                    if not reported[index]:
+                        reported[index] = True
+                        remaining -= 1
+                        timed_out += 1
+                        CHECK_RESULTS.inc(status='TIMEOUT')
+                        CHECK_LOST.inc()
+                        yield index, default_result(url, 'TIMEOUT')
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        queued.close()
+
+    logger.info(f"Checked {expected_count} domains for {username}, {timed_out} timed out")
+    if timed_out:
+        logger.warning(f"{timed_out} of {expected_count} checks timed out for {username}")
+
+def normalize_domains(domains):
+    return [domain['url'] if isinstance(domain, dict) and 'url' in domain else domain for domain in domains]
+
+def iter_check_url_mt(domains, username, apm_context=None, max_result_age=0, probe_mode=None):
+    """Yield each result as soon as its probe finishes, nothing is persisted here"""
+    urls = normalize_domains(domains)
+    logger.info(f"Dispatching {len(urls)} domains for {username}")
+    for _, result in dispatch_checks(urls, username, apm_context, max_result_age, probe_mode):
+        yield result
 
+def check_url_mt(domains, username, apm_context=None, max_result_age=0, probe_mode=None):
+    """Check domains with a thread pool, hosts probed by another user within max_result_age seconds are reused"""
+    urls = normalize_domains(domains)
+    logger.info(f"Dispatching {len(urls)} domains for {username}")
+    results = [None] * len(urls)
+    for index, result in dispatch_checks(urls, username, apm_context, max_result_age, probe_mode):
+        results[index] = result
     update_domains(results, username)
     return results
 
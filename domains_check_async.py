@@ -0,0 +1,259 @@
+import asyncio
+import ssl
+import threading
+import time
+from queue import Queue
+from urllib.parse import urlsplit, urljoin
+from config import logger , Config
+from DataManagement import update_domains
+from domains_check_MT import parse_certificate, default_result, normalize_domains
+from elasticapm import traces , capture_span
+from utils import normalize_host, probe_url
+from cert_cache import certificate_cache
+from probe_coalescer import probe_coalescer, ProbeCancelled
+from dns_cache import dns_cache
+from adaptive_limiter import limiter, resolve_destination_async, probe_outcome
+from metrics import timed, count_results, PHASE_SECONDS, CHECK_FAILURES, CHECK_LOST, QueuedWork
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+_ssl_context = None
+
+def get_ssl_context():
+    """Build the default TLS context once, loading the CA bundle is expensive"""
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+async def open_resolved_connection(host, port, timeout, use_ssl=False):
+    """Connect to the cached addresses of host in turn, TLS still verifies against the hostname
+
+    timeout bounds each connect attempt and the handshake separately, like a socket timeout does.
+    """
+    addresses = await dns_cache.resolve_async(host)
+    with timed('connect'):
+        for number, address in enumerate(addresses, 1):
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(address, port), timeout=timeout)
+                break
+            except (OSError, asyncio.TimeoutError):
+                if number == len(addresses):
+                    raise
+    if use_ssl:
+        # Upgraded separately so the handshake is timed on its own
+        try:
+            with timed('tls'):
+                await asyncio.wait_for(writer.start_tls(get_ssl_context(), server_hostname=host), timeout=timeout)
+        except BaseException:
+            writer.close()
+            raise
+    return reader, writer
+
+async def check_certificate_async(url):
+    cached = certificate_cache.get(url)
+    if cached:
+        return cached
+    try:
+        reader, writer = await open_resolved_connection(url, Config.PROBE_HTTPS_PORT, Config.SSL_TIMEOUT, use_ssl=True)
+        try:
+            cert = writer.get_extra_info('peercert')
+        finally:
+            writer.close()
+        cert_info = parse_certificate(cert)
+        certificate_cache.put(url, cert_info)
+        return cert_info
+    except Exception as e:
+        CHECK_FAILURES.inc(phase='certificate')
+        return ('failed', 'unknown', 'unknown')
+
+async def fetch_status_async(url, method='GET'):
+    """Return the final HTTP status of probe_url(url), following redirects like requests.get does"""
+    target = f'{probe_url(url)}/'
+    for _ in range(Config.MAX_REDIRECTS + 1):
+        parts = urlsplit(target)
+        is_https = parts.scheme == 'https'
+        port = parts.port or (443 if is_https else 80)
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+
+        reader, writer = await open_resolved_connection(parts.hostname, port, Config.HTTP_TIMEOUT, use_ssl=is_https)
+        try:
+            with timed('first_byte'):
+                writer.write(
+                    f'{method} {path} HTTP/1.1\r\n'
+                    f'Host: {parts.netloc}\r\n'
+                    'User-Agent: domain-monitor\r\n'
+                    'Accept: */*\r\n'
+                    'Connection: close\r\n\r\n'.encode('latin-1')
+                )
+                await writer.drain()
+                status, location = await asyncio.wait_for(read_response_head(reader), timeout=Config.HTTP_TIMEOUT)
+        finally:
+            writer.close()
+
+        if status in REDIRECT_CODES and location:
+            target = urljoin(target, location)
+            continue
+        return status
+    raise RuntimeError(f"Exceeded {Config.MAX_REDIRECTS} redirects")
+
+async def probe_status_async(url, probe_mode):
+    """The body is never read here, so 'get' and 'stream' behave the same and 'head' tries HEAD first"""
+    if probe_mode == 'head':
+        try:
+            status = await fetch_status_async(url, 'HEAD')
+            if status == 200:
+                return status
+        except asyncio.TimeoutError:
+            raise
+        except Exception as e:
+            logger.debug(f"HEAD failed for {url}, falling back to GET: {e}")
+    return await fetch_status_async(url)
+
+async def read_response_head(reader):
+    """Read the status line and headers only, the body is never downloaded"""
+    status_line = await reader.readline()
+    status = int(status_line.split()[1])
+    location = None
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'location':
+            location = value.strip()
+    return status, location
+
+class AsyncGate():
+    """Per-run admission for the event loop, slots and destination caps are the shared AdaptiveLimiter's"""
+
+    def __init__(self, count):
+        self.queued = QueuedWork(count)
+
+    async def acquire(self, destination):
+        await limiter.acquire_async(destination, Config.ASYNC_CONCURRENCY)
+        self.queued.start()
+
+    def release(self, destination, latency, outcome):
+        limiter.release(destination, latency, outcome)
+
+async def probe_host_async(host, probe_mode=None):
+    """Run the TLS and HTTP probes for one normalized host and return the result fields"""
+    fields = {key: value for key, value in default_result(host).items() if key != 'url'}
+    (ssl_status, expiry_date, issuer_name), http_status = await asyncio.gather(
+        check_certificate_async(host),
+        probe_status_async(host, probe_mode or Config.PROBE_MODE)
+    )
+    if http_status == 200:
+        fields.update({
+            'status_code': 'OK',
+            'ssl_status': ssl_status,
+            'expiration_date': expiry_date,
+            'issuer': issuer_name
+        })
+    return fields
+
+async def check_one_async(url, gate, max_result_age=0, probe_mode=None):
+    result = default_result(url)
+    host = normalize_host(url)
+    recent = probe_coalescer.recent(host, max_result_age)
+    if recent is not None:
+        gate.queued.start()
+        result.update(recent)
+        return result
+
+    destination = await resolve_destination_async(host)
+    await gate.acquire(destination)
+    probe_started = time.monotonic()
+    try:
+        with capture_span(name=url, span_type="external"):
+            # Joins a probe of the same host already running in this or another engine
+            probe = asyncio.ensure_future(
+                probe_coalescer.probe_async(host, lambda host: probe_host_async(host, probe_mode), max_age=max_result_age)
+            )
+            try:
+                done, _ = await asyncio.wait({probe}, timeout=Config.DOMAIN_CHECK_TIMEOUT)
+                if not done:
+                    probe.cancel()
+                    result['status_code'] = 'TIMEOUT'
+                    return result
+                result.update(probe.result())
+            except ProbeCancelled:
+                result['status_code'] = 'TIMEOUT'
+            except Exception as e:
+                CHECK_FAILURES.inc(phase='http')
+                logger.error(f"Error checking {host}: {str(e)}")
+    finally:
+        latency = time.monotonic() - probe_started
+        PHASE_SECONDS.observe(latency, phase='total')
+        gate.release(destination, latency, probe_outcome(result['status_code'], latency))
+    return result
+
+async def run_checks_async(urls, apm_context=None, max_result_age=0, on_result=None, probe_mode=None):
+    """Check every url on one event loop, results come back in input order
+
+    on_result is called with each result as soon as it is ready, unfinished checks are reported at the deadline.
+    """
+    traces.execution_context.set_transaction(apm_context)
+    # Resolve the whole batch concurrently, the probes then hit the cache
+    dns_cache.prefetch(normalize_host(url) for url in urls)
+    if not urls:
+        return []
+    gate = AsyncGate(len(urls))
+    tasks = [asyncio.create_task(check_one_async(url, gate, max_result_age, probe_mode)) for url in urls]
+    if on_result:
+        for task in tasks:
+            task.add_done_callback(lambda task: None if task.cancelled() else on_result(task.result()))
+
+    done, not_done = await asyncio.wait(tasks, timeout=Config.OVERALL_CHECK_TIMEOUT)
+    if not_done:
+        logger.warning(f"{len(not_done)} checks did not complete in {Config.OVERALL_CHECK_TIMEOUT}s")
+        CHECK_LOST.inc(len(not_done))
+        for task in not_done:
+            task.cancel()
+        await asyncio.gather(*not_done, return_exceptions=True)
+    gate.queued.close()
+
+    results = [task.result() if task in done else default_result(url, 'TIMEOUT') for url, task in zip(urls, tasks)]
+    count_results(results)
+    if on_result:
+        for url, task in zip(urls, tasks):
+            if task not in done:
+                on_result(default_result(url, 'TIMEOUT'))
+    return results
+
+def iter_check_url_async(domains, username, apm_context=None, max_result_age=0, probe_mode=None):
+    """Yield each result as soon as its probe finishes, nothing is persisted here"""
+    urls = normalize_domains(domains)
+    results_queue = Queue()
+
+    def run_loop():
+        try:
+            asyncio.run(run_checks_async(urls, apm_context, max_result_age, on_result=results_queue.put, probe_mode=probe_mode))
+        except Exception as e:
+            logger.error(f"Async check loop failed for {username}: {str(e)}")
+        finally:
+            results_queue.put(None)
+
+    threading.Thread(target=run_loop, name=f"async-check-{username}", daemon=True).start()
+    while True:
+        result = results_queue.get()
+        if result is None:
+            break
+        yield result
+
+def check_url_async(domains, username, apm_context=None, max_result_age=0, probe_mode=None):
+    """Drop-in replacement for check_url_mt running on a single event loop"""
+    urls = normalize_domains(domains)
+    logger.info(f"Checking {len(urls)} domains for {username} with async engine")
+
+    results = asyncio.run(run_checks_async(urls, apm_context, max_result_age, probe_mode=probe_mode))
+
+    logger.info(f"Expected {len(urls)} results, got {len(results)} for {username}")
+    update_domains(results, username)
+    return results
+
+if __name__ == '__main__':
+    urls = ['www.google.com', 'www.facebook.com', 'www.youtube.com']
+    username = 'example_user'
+    print(check_url_async(urls, username))
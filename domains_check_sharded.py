@@ -0,0 +1,101 @@
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from config import logger , Config
+from DataManagement import update_domains
+from domains_check_MT import iter_check_url_mt, default_result, normalize_domains
+from domains_check_async import iter_check_url_async
+from metrics import count_results, CHECK_LOST
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def shard_engine():
+    return iter_check_url_async if Config.SHARD_ENGINE == 'async' else iter_check_url_mt
+
+
+def get_pool():
+    """Worker processes are spawned once and reused, spawn keeps them clear of the parent's threads and sockets"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=process_count(),
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                logger.info(f"Started {process_count()} checker processes")
+    return _pool
+
+
+def process_count():
+    return Config.CHECK_PROCESSES or os.cpu_count() or 1
+
+
+def split_shards(urls):
+    shard_count = Config.CHECK_SHARDS or process_count() * 4
+    shard_size = math.ceil(len(urls) / min(shard_count, len(urls)))
+    return [urls[start:start + shard_size] for start in range(0, len(urls), shard_size)]
+
+
+def check_shard(urls, username, max_result_age=0, probe_mode=None):
+    """Runs inside a worker process, results go back to the parent which does the single write"""
+    return list(shard_engine()(urls, username, None, max_result_age, probe_mode))
+
+
+def iter_check_url_sharded(domains, username, apm_context=None, max_result_age=0, probe_mode=None):
+    """Yield results shard by shard as worker processes finish them, nothing is persisted here"""
+    urls = normalize_domains(domains)
+    if len(urls) < Config.SHARDED_MIN_DOMAINS:
+        # Not worth the IPC, run the I/O engine in this process
+        yield from shard_engine()(urls, username, apm_context, max_result_age, probe_mode)
+        return
+
+    shards = split_shards(urls)
+    logger.info(f"Checking {len(urls)} domains for {username} in {len(shards)} shards on {process_count()} processes")
+    pool = get_pool()
+    futures = {pool.submit(check_shard, shard, username, max_result_age, probe_mode): shard for shard in shards}
+
+    # Shards beyond the process count queue up, each wave gets its own overall timeout
+    waves = math.ceil(len(shards) / process_count())
+    timeout = Config.OVERALL_CHECK_TIMEOUT * waves + Config.DOMAIN_CHECK_TIMEOUT
+    finished = set()
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            finished.add(future)
+            try:
+                results = future.result()
+            except Exception as e:
+                logger.error(f"Shard of {len(futures[future])} domains failed for {username}: {str(e)}")
+                CHECK_LOST.inc(len(futures[future]))
+                results = [default_result(url) for url in futures[future]]
+            # Worker processes keep their own phase histograms, the parent counts the results
+            count_results(results)
+            yield from results
+    except FuturesTimeoutError:
+        logger.warning(f"{len(futures) - len(finished)} shards did not finish in {timeout}s for {username}")
+        for future, shard in futures.items():
+            if future not in finished:
+                future.cancel()
+                CHECK_LOST.inc(len(shard))
+                results = [default_result(url, 'TIMEOUT') for url in shard]
+                count_results(results)
+                yield from results
+
+
+def check_url_sharded(domains, username, apm_context=None, max_result_age=0, probe_mode=None):
+    """Spread a large domain list over worker processes and write every result in one update_domains call"""
+    urls = normalize_domains(domains)
+    by_url = {result['url']: result for result in iter_check_url_sharded(urls, username, apm_context, max_result_age, probe_mode)}
+    results = [by_url[url] for url in urls]
+    update_domains(results, username)
+    return results
+
+
+if __name__ == '__main__':
+    urls = ['www.google.com', 'www.facebook.com', 'www.youtube.com']
+    username = 'example_user'
+    print(check_url_sharded(urls, username))
@@ -0,0 +1,148 @@
+import threading
+import time
+from config import logger , Config
+from domain_store import get_connection, transaction, chunked
+
+INSERT_HISTORY = """
+INSERT OR REPLACE INTO check_history (username, url, checked_at, status_code, ssl_status, expiration_date)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+# Hourly counters, uptime queries sum these instead of scanning the raw history
+UPSERT_ROLLUP = """
+INSERT INTO check_rollups (username, url, hour, checks, ok) VALUES (?, ?, ?, 1, ?)
+ON CONFLICT (username, url, hour) DO UPDATE SET checks = checks + 1, ok = ok + excluded.ok
+"""
+
+# ssl_status is the last TLS answer, expiration and issuer those of the last valid certificate
+UPSERT_KNOWN_CERT = """
+INSERT INTO known_certs (username, url, ssl_status, expiration_date, issuer) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (username, url) DO UPDATE SET
+    ssl_status = excluded.ssl_status,
+    expiration_date = CASE WHEN excluded.ssl_status = 'valid' THEN excluded.expiration_date ELSE expiration_date END,
+    issuer = CASE WHEN excluded.ssl_status = 'valid' THEN excluded.issuer ELSE issuer END
+"""
+
+INSERT_CERT_EVENT = """
+INSERT INTO cert_events (username, url, changed_at, event, old_expiration, new_expiration, old_issuer, new_issuer)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_last_prune = 0.0
+_prune_lock = threading.Lock()
+
+
+def cert_event(previous, result):
+    """Name of the certificate change between the known certificate and a new result, None when nothing changed
+
+    previous is (last ssl_status, expiration_date, issuer of the last valid certificate), results
+    without a TLS answer are ignored.
+    """
+    ssl_status = result.get('ssl_status', 'unknown')
+    if ssl_status == 'unknown':
+        return None
+    old_status, old_expiration, old_issuer = previous
+    if ssl_status != 'valid':
+        return 'invalid' if old_status == 'valid' else None
+    if old_status != 'valid':
+        return 'issued' if old_expiration == 'unknown' else 'restored'
+    if result.get('expiration_date') != old_expiration:
+        return 'renewed'
+    if result.get('issuer') != old_issuer:
+        return 'issuer_changed'
+    return None
+
+
+def known_certificates(conn, username, urls):
+    """url -> (ssl_status, expiration_date, issuer) from known_certs, primary key lookups only"""
+    known = {}
+    for chunk in chunked(urls):
+        rows = conn.execute(
+            "SELECT url, ssl_status, expiration_date, issuer FROM known_certs "
+            f"WHERE username = ? AND url IN ({', '.join('?' * len(chunk))})",
+            [username, *chunk]
+        )
+        known.update((row['url'], (row['ssl_status'], row['expiration_date'], row['issuer'])) for row in rows)
+    return known
+
+
+def record_checks(conn, username, results, checked_at=None):
+    """Append one history row per result, bump the hourly rollups and log certificate changes
+
+    Runs inside the caller's transaction, the one that also stores the results. Certificates
+    are compared with the last known one, a failed check in between does not hide it.
+    """
+    checked_at = int(checked_at or time.time())
+    hour = checked_at // 3600
+    answered = [result for result in results if result.get('ssl_status', 'unknown') != 'unknown']
+    previous = known_certificates(conn, username, {result['url'] for result in answered})
+    history, rollups, events = [], [], []
+    for result in results:
+        url = result['url']
+        status_code = result.get('status_code', 'FAILED')
+        history.append((username, url, checked_at, status_code,
+                        result.get('ssl_status', 'unknown'), result.get('expiration_date', 'unknown')))
+        rollups.append((username, url, hour, int(status_code == 'OK')))
+    for result in answered:
+        url = result['url']
+        # A domain seen for the first time counts as having had no certificate
+        before = previous.get(url, ('unknown', 'unknown', 'unknown'))
+        event = cert_event(before, result)
+        if event:
+            old_status, old_expiration, old_issuer = before
+            events.append((username, url, checked_at, event, old_expiration,
+                           result.get('expiration_date'), old_issuer, result.get('issuer')))
+    conn.executemany(INSERT_HISTORY, history)
+    conn.executemany(UPSERT_ROLLUP, rollups)
+    conn.executemany(INSERT_CERT_EVENT, events)
+    conn.executemany(UPSERT_KNOWN_CERT, [
+        (username, result['url'], result['ssl_status'], result.get('expiration_date', 'unknown'), result.get('issuer', 'unknown'))
+        for result in answered
+    ])
+    if events:
+        logger.info(f"{len(events)} certificate changes for {username}")
+
+
+def prune_history(force=False):
+    """Drop rows past their retention, at most once per HISTORY_PRUNE_INTERVAL"""
+    global _last_prune
+    with _prune_lock:
+        if not force and time.time() - _last_prune < Config.HISTORY_PRUNE_INTERVAL:
+            return
+        _last_prune = time.time()
+    history_cutoff = int(time.time() - Config.HISTORY_RETENTION_DAYS * 86400)
+    rollup_cutoff = int(time.time() - Config.HISTORY_ROLLUP_RETENTION_DAYS * 86400)
+    conn = get_connection()
+    with transaction(conn):
+        removed = conn.execute("DELETE FROM check_history WHERE checked_at < ?", (history_cutoff,)).rowcount
+        removed += conn.execute("DELETE FROM check_rollups WHERE hour < ?", (rollup_cutoff // 3600,)).rowcount
+        removed += conn.execute("DELETE FROM cert_events WHERE changed_at < ?", (rollup_cutoff,)).rowcount
+    if removed:
+        logger.info(f"Pruned {removed} history rows")
+
+
+def uptime(username, start, end, url=None):
+    """Checks, successes and uptime percentage per domain between two epoch times, at hour granularity"""
+    query = ("SELECT url, SUM(checks) AS checks, SUM(ok) AS ok FROM check_rollups "
+             "WHERE username = ? AND hour BETWEEN ? AND ?")
+    params = [username, int(start) // 3600, int(end) // 3600]
+    if url:
+        query += " AND url = ?"
+        params.append(url)
+    rows = get_connection().execute(query + " GROUP BY url ORDER BY url", params)
+    return [{
+        'url': row['url'],
+        'checks': row['checks'],
+        'ok': row['ok'],
+        'uptime_percent': round(100.0 * row['ok'] / row['checks'], 2) if row['checks'] else None
+    } for row in rows]
+
+
+def cert_events(username, start, end, url=None):
+    query = ("SELECT url, changed_at, event, old_expiration, new_expiration, old_issuer, new_issuer "
+             "FROM cert_events WHERE username = ? AND changed_at BETWEEN ? AND ?")
+    params = [username, int(start), int(end)]
+    if url:
+        query += " AND url = ?"
+        params.append(url)
+    return [dict(row) for row in get_connection().execute(query + " ORDER BY changed_at", params)]
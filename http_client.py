@@ -0,0 +1,131 @@
+import socket
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+from config import logger , Config
+from dns_cache import dns_cache
+from metrics import PHASE_SECONDS
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class ResolvedConnectionMixin():
+    """Connect to the address from the shared resolver cache, SNI and Host keep the hostname"""
+
+    def _new_conn(self):
+        hostname = self._dns_host
+        try:
+            addresses = dns_cache.resolve(hostname.rstrip('.'))
+        except socket.gaierror as e:
+            raise NewConnectionError(self, f"Failed to resolve {hostname}: {e}") from e
+        started = time.monotonic()
+        try:
+            # Each address in turn like urllib3 does with getaddrinfo, the last failure is raised
+            for number, address in enumerate(addresses, 1):
+                # Only the TCP connect sees the address, TLS runs afterwards with the hostname restored
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except ConnectTimeoutError:
+                    if number == len(addresses):
+                        raise
+        finally:
+            self._dns_host = hostname
+            self._connect_seconds = time.monotonic() - started
+            PHASE_SECONDS.observe(self._connect_seconds, phase='connect')
+
+
+class ResolvedHTTPConnection(ResolvedConnectionMixin, HTTPConnection):
+    pass
+
+
+class ResolvedHTTPSConnection(ResolvedConnectionMixin, HTTPSConnection):
+    def connect(self):
+        # connect() is the TCP connect from _new_conn plus the handshake, the difference is TLS
+        self._connect_seconds = 0.0
+        started = time.monotonic()
+        try:
+            super().connect()
+        finally:
+            PHASE_SECONDS.observe(time.monotonic() - started - self._connect_seconds, phase='tls')
+
+
+class ResolvedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = ResolvedHTTPConnection
+
+
+class ResolvedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = ResolvedHTTPSConnection
+
+
+class ResolvedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': ResolvedHTTPConnectionPool,
+            'https': ResolvedHTTPSConnectionPool
+        }
+
+
+def get_session():
+    """Shared pooled session for the checker, connections are kept alive between checks"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = ResolvedHTTPAdapter(
+                    pool_connections=Config.HTTP_POOL_HOSTS,  # number of per-host pools kept around
+                    pool_maxsize=Config.HTTP_POOL_PER_HOST,   # keep-alive connections kept per host
+                    max_retries=0
+                )
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                # Probed sites must not be able to grow a shared cookie jar
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                _session = session
+                logger.debug(f"HTTP session ready ({Config.HTTP_POOL_HOSTS} hosts x {Config.HTTP_POOL_PER_HOST} connections)")
+    return _session
+
+
+def peer_certificate(response, hostname):
+    """Certificate of the TLS connection that served response, if it was https on hostname
+
+    The response must have been requested with stream=True so the connection is still attached.
+    """
+    if urlsplit(response.url).scheme != 'https' or urlsplit(response.url).hostname != hostname:
+        return None
+    try:
+        connection = getattr(response.raw, 'connection', None)
+        sock = getattr(connection, 'sock', None)
+        if sock is None or not hasattr(sock, 'getpeercert'):
+            return None
+        return sock.getpeercert() or None
+    except Exception as e:
+        logger.debug(f"Could not read peer certificate for {hostname}: {e}")
+        return None
+
+
+def release_response(response, max_body_bytes=None):
+    """Read at most max_body_bytes of a streamed body (all of it when None) and release the connection
+
+    A body read to the end hands its connection back to the pool, a truncated one is closed.
+    """
+    try:
+        if max_body_bytes is None:
+            response.content
+        elif max_body_bytes > 0:
+            read = 0
+            for chunk in response.iter_content(chunk_size=min(max_body_bytes, 16384)):
+                read += len(chunk)
+                if read >= max_body_bytes:
+                    break
+    finally:
+        response.close()
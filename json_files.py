@@ -0,0 +1,113 @@
+import atexit
+import copy
+import json
+import os
+import tempfile
+import threading
+from config import logger , Config
+
+
+def write_json_atomic(path, data):
+    """Write to a temp file in the same directory and os.replace it over path, readers never see half a file"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class JsonFiles():
+    """Read-modify-write of JSON files under a lock per file, with atomic replace on flush
+
+    With flush_delay > 0 a coalesced write only marks the file dirty, every change made during
+    the delay goes to disk in a single flush. Reads see the pending data, so callers in this
+    process never observe the delay.
+    """
+
+    def __init__(self, flush_delay=0):
+        self.flush_delay = flush_delay
+        self._locks = {}  # absolute path -> RLock
+        self._pending = {}  # absolute path -> data waiting for its flush
+        self._timers = {}
+        self._versions = {}  # absolute path -> writes made through this instance, pending ones included
+        self._guard = threading.Lock()
+
+    def lock(self, path):
+        path = os.path.abspath(path)
+        with self._guard:
+            lock = self._locks.get(path)
+            if lock is None:
+                lock = self._locks[path] = threading.RLock()
+            return lock
+
+    def version(self, path):
+        """Changes whenever path does, on disk by any process or a hand edit, or through a write here not flushed yet"""
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+            on_disk = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            on_disk = None
+        return (on_disk, self._versions.get(path, 0))
+
+    def read(self, path, default=None):
+        """Parsed content of path, default() when it does not exist"""
+        path = os.path.abspath(path)
+        with self.lock(path):
+            if path in self._pending:
+                return copy.deepcopy(self._pending[path])
+            if not os.path.exists(path):
+                return default() if default else None
+            with open(path, 'r') as f:
+                return json.load(f)
+
+    def write(self, path, data, coalesce=True):
+        path = os.path.abspath(path)
+        with self.lock(path):
+            self._versions[path] = self._versions.get(path, 0) + 1
+            if not coalesce or self.flush_delay <= 0:
+                self._pending.pop(path, None)
+                write_json_atomic(path, data)
+                return
+            self._pending[path] = copy.deepcopy(data)
+            if path not in self._timers:
+                timer = threading.Timer(self.flush_delay, self.flush, args=(path,))
+                timer.daemon = True
+                self._timers[path] = timer
+                timer.start()
+
+    def update(self, path, mutate, default=None, coalesce=True):
+        """Apply mutate(data) in place under the file lock and write the result, returns what mutate returns"""
+        with self.lock(path):
+            data = self.read(path, default)
+            result = mutate(data)
+            self.write(path, data, coalesce=coalesce)
+            return result
+
+    def flush(self, path=None):
+        """Write pending data now, for one path or for every dirty file"""
+        paths = [os.path.abspath(path)] if path else list(self._pending)
+        for path in paths:
+            with self.lock(path):
+                timer = self._timers.pop(path, None)
+                if timer is not None:
+                    timer.cancel()
+                data = self._pending.pop(path, None)
+                if data is None:
+                    continue
+                try:
+                    write_json_atomic(path, data)
+                except Exception as e:
+                    logger.error(f"Could not flush {path}: {str(e)}")
+
+
+json_files = JsonFiles(flush_delay=Config.JSON_FLUSH_DELAY)
+# Pending coalesced writes must reach the disk on a clean shutdown
+atexit.register(json_files.flush)
@@ -1,48 +1,102 @@
 import json
 import os
-from config import logger
+import threading
+import time
+from config import logger, Config
 from DataManagement import json_directory
+from json_files import json_files, write_json_atomic
 
 
+def users_file_path():
+    return os.path.join(json_directory(), 'users.json')
+
 def initialize_users_file():
     """Creates users.json if it doesn't exist"""
     try:
-        json_dir = json_directory()
-        file_path = os.path.join(json_dir, 'users.json')
-        if not os.path.exists(file_path):
-            logger.info("Creating new users.json file")
-            default_structure = {
-                "users": []
-            }
-            with open(file_path, 'w') as f:
-                json.dump(default_structure, f, indent=4)
-            logger.info("users.json created successfully")
+        file_path = users_file_path()
+        if os.path.exists(file_path):
+            return
+        with json_files.lock(file_path):
+            if not os.path.exists(file_path):
+                logger.info("Creating new users.json file")
+                default_structure = {
+                    "users": []
+                }
+                write_json_atomic(file_path, default_structure)
+                logger.info("users.json created successfully")
     except Exception as e:
         logger.error(f"Error creating users.json: {str(e)}", exc_info=True)
         raise
 
+
+class UserIndex():
+    """In-memory view of users.json keyed by lowercased username, reloaded only when the file mtime changes"""
+
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self._users_file = None  # parsed users.json, kept so registration can write without re-reading
+        self._by_name = {}
+        self._path = None
+        self._mtime = None
+        self._checked_at = 0
+        self.lock = threading.RLock()
+
+    def get(self, username):
+        with self.lock:
+            self._refresh()
+            return self._by_name.get(username.lower())
+
+    def add(self, new_user):
+        """Append a user and persist users.json, the cached index only changes once the write succeeded"""
+        with self.lock:
+            self._refresh(force=True)
+            users_file = dict(self._users_file, users=self._users_file.get('users', []) + [new_user])
+            # Credentials are written through, never left in a coalescing buffer
+            json_files.write(self._path, users_file, coalesce=False)
+            self._users_file = users_file
+            self._by_name[new_user['username'].lower()] = new_user
+            self._mtime = os.stat(self._path).st_mtime_ns
+            self._checked_at = time.monotonic()
+
+    def _refresh(self, force=False):
+        path = users_file_path()
+        now = time.monotonic()
+        if not force and path == self._path and now - self._checked_at < self.refresh_seconds:
+            return
+        initialize_users_file()
+        mtime = os.stat(path).st_mtime_ns
+        self._checked_at = now
+        if path == self._path and mtime == self._mtime:
+            return
+
+        with open(path, 'r') as f:
+            users_file = json.load(f)
+        by_name = {}
+        for user_dict in users_file.get('users', []):
+            # First entry wins, matching the old linear scan
+            by_name.setdefault(user_dict.get('username').lower(), user_dict)
+        self._users_file, self._by_name = users_file, by_name
+        self._path, self._mtime = path, mtime
+        logger.debug(f"Loaded {len(by_name)} users into the login index")
+
+
+user_index = UserIndex(refresh_seconds=Config.USER_INDEX_REFRESH_SECONDS)
+
 def check_login(username, password):
     """function for checking login credentials"""
     logger.debug(f"Checking login for user: {username}")
-    initialize_users_file()
 
     try:
-        json_dir = json_directory()
-        file_path = os.path.join(json_dir, 'users.json')
-        with open(file_path, 'r') as f:
-            users_file = json.load(f)
-
-        users_file = users_file.get('users')
-        for user_dict in users_file:
-            if username.upper() == user_dict.get('username').upper():
-                if password == user_dict.get('password'):
-                    is_google = user_dict.get('is_google_user', False)
-                    login_type = "Google" if is_google else "regular"
-                    logger.info(f"Successful {login_type} login for user: {username}")
-                    return True
-                else:
-                    logger.warning(f"Failed login attempt for user: {username} - Invalid password")
-                    return False
+        user_dict = user_index.get(username)
+        if user_dict is not None:
+            if password == user_dict.get('password'):
+                is_google = user_dict.get('is_google_user', False)
+                login_type = "Google" if is_google else "regular"
+                logger.info(f"Successful {login_type} login for user: {username}")
+                return True
+            else:
+                logger.warning(f"Failed login attempt for user: {username} - Invalid password")
+                return False
         
         logger.warning(f"Failed login attempt - User not found: {username}")
         return False
@@ -54,19 +108,11 @@ def check_login(username, password):
 def check_username_avaliability(username):
     """Check if the username is free before new registration"""
     logger.debug(f"Checking availability for username: {username}")
-    initialize_users_file()
 
     try:
-        json_dir = json_directory()
-        file_path = os.path.join(json_dir, 'users.json')
-        with open(file_path, 'r') as f:
-            users_file = json.load(f)
-
-        users_file = users_file.get('users')
-        for user_dict in users_file:
-            if user_dict.get('username').upper() == username.upper():
-                logger.debug(f"Username '{username}' already exists")
-                return False
+        if user_index.get(username) is not None:
+            logger.debug(f"Username '{username}' already exists")
+            return False
 
         logger.debug(f"Username '{username}' is available")
         return True
@@ -76,44 +122,27 @@ def check_username_avaliability(username):
 
 def registration(username, password, full_name=None, is_google_user=False, profile_picture=None):
     """function for register new username"""
-    initialize_users_file()
-
     try:
-        if check_username_avaliability(username):
-            NewUser = {
-                'username': username.lower(),
-                'password': password,
-                'full_name': full_name,
-                'is_google_user': is_google_user,
-                'profile_picture': profile_picture
-            }
-
-            json_dir = json_directory()
-            file_path = os.path.join(json_dir, 'users.json')
-            with open(file_path, 'r') as f:
-                users_file = json.load(f)
-
-            users_file['users'].append(NewUser)
-
-            with open(file_path, 'w') as f:
-                json.dump(users_file, f, indent=4)
-            
-            user_type = "Google" if is_google_user else "regular"
-            logger.info(f"New {user_type} user registered: {username}")
-        else:
-            # If user exists and it's a Google login attempt, log appropriately
-            json_dir = json_directory()
-            file_path = os.path.join(json_dir, 'users.json')
-            with open(file_path, 'r') as f:
-                users_file = json.load(f)
-            
-            for user in users_file.get('users', []):
-                if user.get('username').lower() == username.lower():
-                    if is_google_user:
-                        logger.info(f"Existing Google user logged in: {username}")
-                    else:
-                        logger.info(f"User already exists: {username}")
-                    break
+        # Hold the index lock so two registrations of the same name cannot both pass the check
+        with user_index.lock:
+            if check_username_avaliability(username):
+                NewUser = {
+                    'username': username.lower(),
+                    'password': password,
+                    'full_name': full_name,
+                    'is_google_user': is_google_user,
+                    'profile_picture': profile_picture
+                }
+                user_index.add(NewUser)
+                
+                user_type = "Google" if is_google_user else "regular"
+                logger.info(f"New {user_type} user registered: {username}")
+            else:
+                # If user exists and it's a Google login attempt, log appropriately
+                if is_google_user:
+                    logger.info(f"Existing Google user logged in: {username}")
+                else:
+                    logger.info(f"User already exists: {username}")
                     
     except Exception as e:
         logger.error(f"Error during registration: {str(e)}", exc_info=True)
@@ -0,0 +1,184 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds, from a warm keep-alive request up to the slowest timeouts in .env
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def label_text(label_names, values):
+    if not label_names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(label_names, values)) + '}'
+
+
+class Metric():
+    kind = None
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.label_names)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, description, label_names=()):
+        super().__init__(name, description, label_names)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{label_text(self.label_names, key)} {value}' for key, value in values]
+
+
+class Gauge(Metric):
+    """Either set directly or read from a callback at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, description, callback=None):
+        super().__init__(name, description)
+        self.callback = callback
+        self._value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def _samples(self):
+        value = self.callback() if self.callback else self._value
+        return [f'{self.name} {value}']
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if position < len(self.buckets):
+                series[position] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def _samples(self):
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = []
+        names = self.label_names + ('le',)
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{label_text(names, key + (bound,))} {cumulative}')
+            lines.append(f'{self.name}_bucket{label_text(names, key + ("+Inf",))} {values[-1]}')
+            lines.append(f'{self.name}_sum{label_text(self.label_names, key)} {values[-2]:.6f}')
+            lines.append(f'{self.name}_count{label_text(self.label_names, key)} {values[-1]}')
+        return lines
+
+
+class Registry():
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.setdefault(metric.name, metric)
+            return self._metrics[metric.name]
+
+    def render(self):
+        """Prometheus text exposition format, version 0.0.4"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+PHASE_SECONDS = registry.register(Histogram(
+    'domain_check_phase_seconds',
+    'Probe time per phase: dns, connect, tls, first_byte (request until response head) and total',
+    ('phase',)
+))
+CHECK_RESULTS = registry.register(Counter('domain_check_results_total', 'Finished checks by status', ('status',)))
+CHECK_FAILURES = registry.register(Counter('domain_check_failures_total', 'Probe errors by phase', ('phase',)))
+CHECK_LOST = registry.register(Counter(
+    'domain_check_lost_total', 'Checks whose worker never delivered a result, reported as TIMEOUT instead'
+))
+QUEUE_DEPTH = registry.register(Gauge('domain_check_queue_depth', 'Checks waiting for a probe slot'))
+
+
+@contextmanager
+def timed(phase):
+    """Observe the block's duration as one sample of PHASE_SECONDS{phase=...}"""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        PHASE_SECONDS.observe(time.monotonic() - started, phase=phase)
+
+
+def count_results(results):
+    for result in results:
+        CHECK_RESULTS.inc(status=result['status_code'])
+
+
+class QueuedWork():
+    """Holds a batch in QUEUE_DEPTH until each item starts, close() clears the ones that never did"""
+
+    def __init__(self, count):
+        self._left = count
+        self._lock = threading.Lock()
+        QUEUE_DEPTH.inc(count)
+
+    def start(self):
+        with self._lock:
+            if self._left > 0:
+                self._left -= 1
+                QUEUE_DEPTH.dec()
+
+    def close(self):
+        with self._lock:
+            QUEUE_DEPTH.dec(self._left)
+            self._left = 0
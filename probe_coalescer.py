@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from config import Config
+
+
+class ProbeCancelled(Exception):
+    """The probe a caller joined was cancelled before it finished, usually by its deadline"""
+
+
+class ProbeCoalescer():
+    """Merges in-flight and recent probes of the same normalized host across users and jobs"""
+
+    def __init__(self, window, max_entries):
+        self.window = window
+        self.max_entries = max_entries
+        self._inflight = {}  # host -> Future of the probe currently running
+        self._recent = OrderedDict()  # host -> (finished_at, fields), oldest first
+        self._lock = threading.Lock()
+
+    def probe(self, host, probe_func, max_age=0):
+        """Return probe_func(host), sharing the result with every concurrent caller for that host"""
+        with self._lock:
+            fields = self._lookup_recent(host, max_age)
+            if fields is not None:
+                return dict(fields)
+            future = self._inflight.get(host)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._inflight[host] = future
+
+        if not is_leader:
+            return dict(future.result())
+
+        try:
+            fields = probe_func(host)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(fields)
+            self.remember(host, fields)
+        finally:
+            with self._lock:
+                self._inflight.pop(host, None)
+        return dict(fields)
+
+    async def probe_async(self, host, probe_func, max_age=0):
+        """probe for an event loop, probe_func is a coroutine function and in-flight probes are
+        shared with the threads and every other loop"""
+        with self._lock:
+            fields = self._lookup_recent(host, max_age)
+            if fields is not None:
+                return dict(fields)
+            future = self._inflight.get(host)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._inflight[host] = future
+
+        if not is_leader:
+            # Shielded, a follower giving up must not cancel the probe the others wait on
+            return dict(await asyncio.shield(asyncio.wrap_future(future)))
+
+        try:
+            fields = await probe_func(host)
+        except asyncio.CancelledError:
+            # Followers get an exception of their own, not a cancellation they did not ask for
+            future.set_exception(ProbeCancelled(f"Probe of {host} was cancelled"))
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(fields)
+            self.remember(host, fields)
+        finally:
+            with self._lock:
+                self._inflight.pop(host, None)
+        return dict(fields)
+
+    def recent(self, host, max_age):
+        with self._lock:
+            fields = self._lookup_recent(host, max_age)
+        return dict(fields) if fields is not None else None
+
+    def remember(self, host, fields):
+        now = time.monotonic()
+        with self._lock:
+            self._recent[host] = (now, fields)
+            self._recent.move_to_end(host)
+            # Entries are ordered by finish time, so expired ones are always at the front
+            while self._recent:
+                finished_at, _ = next(iter(self._recent.values()))
+                if len(self._recent) <= self.max_entries and now - finished_at <= self.window:
+                    break
+                self._recent.popitem(last=False)
+
+    def _lookup_recent(self, host, max_age):
+        if max_age <= 0:
+            return None
+        entry = self._recent.get(host)
+        if entry is None or time.monotonic() - entry[0] > min(max_age, self.window):
+            return None
+        return entry[1]
+
+
+probe_coalescer = ProbeCoalescer(window=Config.PROBE_REUSE_WINDOW, max_entries=Config.PROBE_REUSE_MAX_ENTRIES)
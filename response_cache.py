@@ -0,0 +1,80 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import request, jsonify, Response
+from config import logger , Config
+
+
+class CachedBody():
+    """A serialized JSON payload with its ETag, the gzip variant is built on first use"""
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self._gzipped = None
+
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=Config.RESPONSE_GZIP_LEVEL)
+        return self._gzipped
+
+
+class ResponseCache():
+    """Serialized JSON responses per key, rebuilt only when the key's data version moves
+
+    The version is read before the payload is built, so a payload is never older than the
+    version it is stored under. The ETag is a hash of the body, it stays valid across restarts.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (version, CachedBody)
+        self._lock = threading.Lock()
+
+    def get(self, key, version, build):
+        """CachedBody for key at version, build() returns the data to serialize on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        cached = CachedBody(jsonify(build()).get_data())
+        with self._lock:
+            self._entries[key] = (version, cached)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        logger.debug(f"Cached {len(cached.body)} byte response for {key} (version {version})")
+        return cached
+
+
+def accepts_gzip():
+    return request.accept_encodings['gzip'] > 0
+
+
+def conditional_json_response(key, version, build):
+    """200 with the cached JSON body, or an empty 304 when If-None-Match already holds its ETag
+
+    Bodies of at least RESPONSE_GZIP_MIN_BYTES are sent gzip encoded to clients that accept it.
+    """
+    cached = response_cache.get(key, version, build)
+    use_gzip = Config.RESPONSE_GZIP and len(cached.body) >= Config.RESPONSE_GZIP_MIN_BYTES and accepts_gzip()
+    # Each encoding is its own representation and gets its own ETag
+    etag = f'{cached.etag}-gzip' if use_gzip else cached.etag
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    elif use_gzip:
+        response = Response(cached.gzipped(), mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(cached.body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    # Clients may keep the body but must revalidate before using it
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+response_cache = ResponseCache(max_entries=Config.RESPONSE_CACHE_MAX_ENTRIES)
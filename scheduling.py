@@ -0,0 +1,322 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, ConflictingIdError, JobLookupError
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+from config import logger , Config
+from DataManagement import load_user_tasks, update_user_task, json_directory
+from domain_view import domain_view
+from domain_store import get_connection, transaction
+from check_engine import check_url
+from check_planner import due_domains
+
+TASK_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class SQLiteJobStore(BaseJobStore):
+    """APScheduler job store kept in the domains database, so schedules survive a restart"""
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        conn = get_connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS scheduled_jobs (id TEXT PRIMARY KEY, next_run_time REAL, job_state BLOB NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS scheduled_jobs_next_run ON scheduled_jobs (next_run_time)")
+
+    def lookup_job(self, job_id):
+        row = get_connection().execute("SELECT job_state FROM scheduled_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._reconstitute_job(row['job_state']) if row else None
+
+    def get_due_jobs(self, now):
+        return self._get_jobs("WHERE next_run_time <= ?", (datetime_to_utc_timestamp(now),))
+
+    def get_next_run_time(self):
+        row = get_connection().execute("SELECT MIN(next_run_time) AS next_run_time FROM scheduled_jobs").fetchone()
+        return utc_timestamp_to_datetime(row['next_run_time'])
+
+    def get_all_jobs(self):
+        jobs = self._get_jobs()
+        self._fix_paused_jobs_sorting(jobs)
+        return jobs
+
+    def add_job(self, job):
+        conn = get_connection()
+        try:
+            with transaction(conn):
+                conn.execute("INSERT INTO scheduled_jobs (id, next_run_time, job_state) VALUES (?, ?, ?)", self._row(job))
+        except sqlite3.IntegrityError:
+            raise ConflictingIdError(job.id)
+
+    def update_job(self, job):
+        conn = get_connection()
+        job_id, next_run_time, job_state = self._row(job)
+        with transaction(conn):
+            cursor = conn.execute(
+                "UPDATE scheduled_jobs SET next_run_time = ?, job_state = ? WHERE id = ?",
+                (next_run_time, job_state, job_id)
+            )
+        if cursor.rowcount == 0:
+            raise JobLookupError(job.id)
+
+    def remove_job(self, job_id):
+        conn = get_connection()
+        with transaction(conn):
+            cursor = conn.execute("DELETE FROM scheduled_jobs WHERE id = ?", (job_id,))
+        if cursor.rowcount == 0:
+            raise JobLookupError(job_id)
+
+    def remove_all_jobs(self):
+        conn = get_connection()
+        with transaction(conn):
+            conn.execute("DELETE FROM scheduled_jobs")
+
+    def _row(self, job):
+        job_state = pickle.dumps(job.__getstate__(), pickle.HIGHEST_PROTOCOL)
+        return (job.id, datetime_to_utc_timestamp(job.next_run_time), job_state)
+
+    def _reconstitute_job(self, job_state):
+        job_state = pickle.loads(job_state)
+        job_state['jobstore'] = self
+        job = Job.__new__(Job)
+        job.__setstate__(job_state)
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    def _get_jobs(self, where='', params=()):
+        jobs = []
+        failed_job_ids = []
+        rows = get_connection().execute(f"SELECT id, job_state FROM scheduled_jobs {where} ORDER BY next_run_time", params)
+        for row in rows.fetchall():
+            try:
+                jobs.append(self._reconstitute_job(row['job_state']))
+            except Exception:
+                self._logger.exception(f"Unable to restore job {row['id']}, removing it")
+                failed_job_ids.append(row['id'])
+        if failed_job_ids:
+            conn = get_connection()
+            with transaction(conn):
+                conn.executemany("DELETE FROM scheduled_jobs WHERE id = ?", [(job_id,) for job_id in failed_job_ids])
+        return jobs
+
+
+scheduler = BackgroundScheduler(
+    jobstores={'default': SQLiteJobStore()},
+    executors={'default': ThreadPoolExecutor(Config.SCHEDULER_WORKERS)},
+    job_defaults={
+        'coalesce': True,  # Combine missed executions
+        'max_instances': 1,  # Prevent multiple instances
+        'misfire_grace_time': Config.SCHEDULER_MISFIRE_GRACE  # a busy pool delays runs instead of dropping them
+    }
+    # No timezone, a daily "09:00" means 09:00 server local time as it always has
+)
+
+
+class ScheduledCheckGate():
+    """Global cap on scheduled checks probing at once, the rest wait here instead of piling on the checker"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.running = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            if self.running >= self.limit:
+                logger.info(f"Scheduled check queued, {self.running} running and {self.waiting} waiting")
+            self.waiting += 1
+            self._cond.wait_for(lambda: self.running < self.limit)
+            self.waiting -= 1
+            self.running += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self.running -= 1
+            self._cond.notify()
+
+
+scheduled_checks = ScheduledCheckGate(Config.SCHEDULED_CHECK_CONCURRENCY)
+
+
+def user_offset(username, window):
+    """Deterministic offset in [0, window) seconds, the same user always lands in the same slot"""
+    if window <= 0:
+        return 0
+    digest = hashlib.sha256(username.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % window
+
+
+def hourly_start(username, interval):
+    """First run in the user's slot of the spread window, at least 5 seconds from now"""
+    earliest = datetime.now(timezone.utc) + timedelta(seconds=5)
+    period = min(Config.SCHEDULE_SPREAD_WINDOW, int(interval * 3600))
+    if period <= 0:
+        return earliest
+    wait = (user_offset(username, period) - earliest.timestamp()) % period
+    return earliest + timedelta(seconds=wait)
+
+
+def daily_fire_time(username, hour, minute):
+    """The user's hour:minute pushed forward by their offset in the spread window"""
+    fire_time = datetime(2000, 1, 1, hour, minute) + timedelta(seconds=user_offset(username, Config.SCHEDULE_SPREAD_WINDOW))
+    return fire_time.hour, fire_time.minute, fire_time.second
+
+
+def local_time(moment):
+    """Naive scheduler-local text stored in the tasks files, restore_task reads it back in the same zone"""
+    return moment.astimezone(scheduler.timezone).strftime(TASK_TIME_FORMAT)
+
+
+def task_record(task_type, job, settings, **extra):
+    """The entry stored in {username}_tasks.json for a scheduled job"""
+    task = {"type": task_type, **settings, "next_run": local_time(job.next_run_time), "job_id": job.id}
+    task.update(extra)
+    return task
+
+
+def job_interval(task_type, settings):
+    """Seconds between two runs of a job"""
+    if task_type == 'daily':
+        return 86400
+    return float(settings.get('interval', 1)) * 3600
+
+
+def run_scheduled_check(username, task_type, settings):
+    """Body of every scheduled job, module level so the persistent job store can reference it"""
+    try:
+        logger.info(f"Starting scheduled {task_type} check for user {username}")
+        # The user's current domains, those already verified since the previous run are skipped
+        due = due_domains(username, domain_view.urls(username), job_interval=job_interval(task_type, settings))
+        if due:
+            with scheduled_checks:
+                check_url(due, username, max_result_age=Config.PROBE_REUSE_WINDOW)
+
+        # Get the current job and its next run time
+        job = scheduler.get_job(f"{username}_{task_type}_task")
+        if job and job.next_run_time:
+            update_user_task(username, task_record(
+                task_type, job, settings, last_run=datetime.now().strftime(TASK_TIME_FORMAT)
+            ))
+            logger.info(f"Updated next run time for {username}'s {task_type} task to {job.next_run_time}")
+    except Exception as e:
+        logger.error(f"Error in {task_type} scheduled task for {username}: {str(e)}")
+
+
+def schedule_hourly_check(username, interval, next_run_time=None):
+    return scheduler.add_job(
+        run_scheduled_check,
+        trigger=IntervalTrigger(
+            hours=interval,
+            start_date=hourly_start(username, interval),  # Each user gets its own slot in the hour
+            timezone=scheduler.timezone
+        ),
+        args=[username, 'hourly', {"interval": interval}],
+        id=f"{username}_hourly_task",
+        name=f"Hourly domain check for {username}",
+        replace_existing=True,
+        **({'next_run_time': next_run_time} if next_run_time else {})
+    )
+
+
+def schedule_daily_check(username, time, next_run_time=None):
+    hour, minute, second = daily_fire_time(username, *map(int, time.split(':')))
+
+    return scheduler.add_job(
+        run_scheduled_check,
+        trigger=CronTrigger(
+            hour=hour,
+            minute=minute,
+            second=second,  # Users picking the same time fire spread over the window
+            timezone=scheduler.timezone
+        ),
+        args=[username, 'daily', {"time": time}],
+        id=f"{username}_daily_task",
+        name=f"Daily domain check for {username} at {time}",
+        replace_existing=True,
+        **({'next_run_time': next_run_time} if next_run_time else {})
+    )
+
+
+def remove_user_jobs(username):
+    for task_type in ('hourly', 'daily'):
+        job_id = f"{username}_{task_type}_task"
+        if scheduler.get_job(job_id):
+            scheduler.remove_job(job_id)
+
+
+def restore_task(username, task):
+    """Recreate the job for a task that is in the user's tasks file but missing from the job store"""
+    next_run_time = None
+    if task.get("next_run"):
+        next_run_time = datetime.strptime(task["next_run"], TASK_TIME_FORMAT).replace(tzinfo=scheduler.timezone)
+    if task.get("type") == "daily":
+        return schedule_daily_check(username, task.get("time", "00:00"), next_run_time)
+    return schedule_hourly_check(username, task.get("interval", 1), next_run_time)
+
+
+def reconcile_schedules():
+    """Make the job store match the {username}_tasks.json files, which are what users were told"""
+    expected = {}
+    suffix = '_tasks.json'
+    for file_name in sorted(os.listdir(json_directory())):
+        if file_name.endswith(suffix):
+            username = file_name[:-len(suffix)]
+            for task in load_user_tasks(username).get("tasks", []):
+                expected[task.get("job_id")] = (username, task)
+
+    for job in scheduler.get_jobs():
+        if job.id not in expected:
+            scheduler.remove_job(job.id)
+            logger.info(f"Removed scheduled job {job.id} with no matching task")
+        elif len(job.args) == 4:
+            # Stored before jobs loaded their domains at run time, drop the captured list
+            username, task_type, _, settings = job.args
+            job.modify(args=[username, task_type, settings])
+
+    restored = 0
+    for job_id, (username, task) in expected.items():
+        if scheduler.get_job(job_id):
+            continue
+        try:
+            restore_task(username, task)
+            restored += 1
+        except Exception as e:
+            logger.error(f"Could not restore scheduled task {job_id}: {str(e)}")
+    logger.info(f"Scheduler reconciled, {len(expected)} tasks, {restored} restored")
+
+
+def spread_overdue_jobs(now=None):
+    """Runs missed while the service was down start spread over SCHEDULER_STARTUP_SPREAD seconds"""
+    now = now or datetime.now(timezone.utc)
+    overdue = sorted(
+        (job for job in scheduler.get_jobs() if job.next_run_time and job.next_run_time <= now),
+        key=lambda job: job.next_run_time
+    )
+    step = Config.SCHEDULER_STARTUP_SPREAD / max(len(overdue), 1)
+    for position, job in enumerate(overdue):
+        job.modify(next_run_time=now + timedelta(seconds=position * step))
+    if overdue:
+        logger.info(f"Spread {len(overdue)} overdue jobs over {Config.SCHEDULER_STARTUP_SPREAD}s")
+
+
+def start_scheduler():
+    """Start paused so stored jobs can be reconciled and spread before any of them fires
+
+    Call it from the serving process only, every process that starts a scheduler on the shared
+    job table fires each stored job once more.
+    """
+    scheduler.start(paused=True)
+    reconcile_schedules()
+    spread_overdue_jobs()
+    scheduler.resume()
@@ -1,9 +1,18 @@
 import time
 import functools
-from config import setup_logger
+from config import setup_logger, Config
 logger = setup_logger()
 
 
+def normalize_host(url):
+    """Strip scheme, 'www.' and path from a user supplied domain"""
+    return url.replace("https://", "").replace("http://", "").replace("www.", "").split("/")[0]
+
+
+def probe_url(host):
+    """The http:// url the checker requests for a normalized host, PROBE_HTTP_PORT is only spelled out when it is not 80"""
+    return f'http://{host}' if Config.PROBE_HTTP_PORT == 80 else f'http://{host}:{Config.PROBE_HTTP_PORT}'
+
 
 class Utils():
     def __init__(self):